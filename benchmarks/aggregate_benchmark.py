@@ -0,0 +1,80 @@
+"""Per-match latency of the MA2 aggregation methods over a directory of saved payloads.
+
+Payloads can be raw MA2 json files or entries of the StatsPerform response cache
+(e.g. ``.statsperform_cache``), whose json wraps the response under ``payload``.
+
+usage: python benchmarks/aggregate_benchmark.py <payload_dir> [--repeat N]
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from data import DataLoader  # noqa: E402
+
+
+def load_payloads(payload_dir):
+    payloads = []
+    for path in sorted(glob.glob(os.path.join(payload_dir, '**', '*.json'), recursive=True)):
+        with open(path, 'r') as f:
+            payload = json.load(f)
+        if 'payload' in payload and 'feed_name' in payload:
+            if payload['feed_name'] != 'matchstats':
+                continue
+            payload = payload['payload']
+        if 'lineUp' in payload.get('liveData', {}):
+            payloads.append(payload)
+    return payloads
+
+
+def time_per_match(method, payloads, repeat):
+    timings = []
+    for payload in payloads:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            method(payload)
+        timings.append((time.perf_counter() - start) / repeat)
+    return np.array(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('payload_dir')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    payloads = load_payloads(args.payload_dir)
+    assert payloads, f"No MA2 payloads found in {args.payload_dir}"
+
+    # aggregation methods don't touch the client or calendar, so skip __init__
+    loader = DataLoader.__new__(DataLoader)
+
+    benchmarks = {
+        'team (legacy)': loader._aggregate_team_data_legacy,
+        'team': loader._aggregate_team_data,
+        'player (legacy)': loader._aggregate_player_data_legacy,
+        'player': loader._aggregate_player_data,
+    }
+
+    print(f"{len(payloads)} payloads, {args.repeat} repeats, per-match latency in ms")
+    for name, method in benchmarks.items():
+        timings = time_per_match(method, payloads, args.repeat)
+        print(f"{name:<24} mean {timings.mean():8.2f} | median {np.median(timings):8.2f} | p95 {np.percentile(timings, 95):8.2f}")
+
+    # whole season of team rows built in one go
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        loader.aggregate_team_data_batch(payloads)
+    batch_ms = (time.perf_counter() - start) / args.repeat / len(payloads) * 1000
+    print(f"{'team (batch)':<24} mean {batch_ms:8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""Latency of the ordinal loss gradient / hessian: the original n x K implementation, the two-threshold reference
+functions and the fused kernel.
+
+Random labels and latent predictions, thresholds spread over the classes. Checks the fused kernel against the
+two-threshold reference before timing and reports how far the n x K baseline is from it.
+
+usage: python benchmarks/ordinal_loss_benchmark.py [--rows N] [--classes K] [--repeat N]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'models', 'lightgbm'))
+
+from loss import FusedOrdinalLoss, gradient_ordinal_logistic_nll, hessian_ordinal_logistic_nll  # noqa: E402
+
+
+# the gradient / hessian as first implemented in loss.py: n x K sigmoid matrices padded with zeros and ones,
+# differenced and gathered at the label, each function recomputing the class probabilities
+def _sigmoid(z):
+    return 1 / (1 + np.exp(-z))
+
+
+def _pad(a, right):
+    return np.hstack((np.zeros(a.shape[0])[:, np.newaxis], a, np.full(a.shape[0], right)[:, np.newaxis]))
+
+
+def _baseline_probas(y_preds, theta):
+    c_probas = _pad(_sigmoid(theta - y_preds[:, np.newaxis]), 1.0)
+    return c_probas[:, 1:len(theta) + 2] - c_probas[:, 0:len(theta) + 1]
+
+
+def _baseline_terms(y_preds, theta):
+    y_preds = np.clip(y_preds, -20, a_max=700 + min(theta))
+    s = _sigmoid(theta - y_preds[:, np.newaxis])
+    g = s * (1 - s)
+    h = g * (1 - s) - s * g
+    gc, hc = _pad(g, 0.0), _pad(h, 0.0)
+    g_probas = -(gc[:, 1:len(theta) + 2] - gc[:, 0:len(theta) + 1])
+    h_probas = hc[:, 1:len(theta) + 2] - hc[:, 0:len(theta) + 1]
+    return _baseline_probas(y_preds, theta), g_probas, h_probas
+
+
+def baseline_gradient(y_true, y_preds, theta):
+    probas, g_probas, _ = _baseline_terms(y_preds, theta)
+    return -(g_probas / probas)[np.arange(0, len(y_true)), y_true.astype(int)]
+
+
+def baseline_hessian(y_true, y_preds, theta):
+    probas, g_probas, h_probas = _baseline_terms(y_preds, theta)
+    return -(h_probas / probas - np.power(g_probas / probas, 2))[np.arange(0, len(y_true)), y_true.astype(int)]
+
+
+def baseline(y_true, y_preds, theta):
+    return baseline_gradient(y_true, y_preds, theta), baseline_hessian(y_true, y_preds, theta)
+
+
+def two_threshold(y_true, y_preds, theta):
+    return gradient_ordinal_logistic_nll(y_true, y_preds, theta), hessian_ordinal_logistic_nll(y_true, y_preds, theta)
+
+
+def time_call(method, args, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        method(*args)
+        timings.append(time.perf_counter() - start)
+    return np.array(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--classes', type=int, default=60)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    theta = np.linspace(0, args.classes - 2, args.classes - 1)
+    y_true = rng.integers(0, args.classes, args.rows).astype(float)
+    y_preds = y_true + rng.normal(0, 2, args.rows)
+
+    fused = FusedOrdinalLoss()
+    reference = two_threshold(y_true, y_preds, theta)
+    result = fused(y_true, y_preds, theta)
+    assert all(np.allclose(a, b, rtol=1e-12, atol=1e-15) for a, b in zip(reference, result)), \
+        "Fused gradient / hessian differ from the two-threshold reference"
+
+    with np.errstate(all='ignore'):
+        original = baseline(y_true, y_preds, theta)
+    for name, a, b in zip(['gradient', 'hessian'], original, reference):
+        finite = np.isfinite(a)
+        print(f"n x K baseline {name}: {np.mean(~finite):.2%} non finite rows, "
+              f"max abs difference {np.max(np.abs(a - b)[finite], initial=0):.2e} elsewhere")
+
+    benchmarks = {
+        'n x K baseline': baseline,
+        'two-threshold': two_threshold,
+        'fused': fused,
+    }
+
+    print(f"{args.rows} rows, {args.classes} classes, {args.repeat} repeats, latency per call in ms")
+    for name, method in benchmarks.items():
+        with np.errstate(all='ignore'):
+            timings = time_call(method, (y_true, y_preds, theta), args.repeat)
+        print(f"{name:<16} mean {timings.mean():10.2f} | median {np.median(timings):10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+# seconds a cached response stays fresh per feed. None means the response never expires.
+# match stats of a Played match are stored as immutable regardless of this table. the calendars carry the
+# lastUpdated the ingestion ledger compares against, so they expire as quickly as the match feeds
+DEFAULT_FEED_TTLS = {
+    'tournamentcalendar': 15 * 60,
+    'match': 15 * 60,
+    'squads': 24 * 60 * 60,
+    'matchstats': 15 * 60,
+}
+
+
+class ResponseCache:
+    # on-disk cache of StatsPerform feed responses.
+    # entries are addressed by a hash of (feed_name, query params) - tmcl / fx are part of the params -
+    # and evicted least recently used first once the directory grows past max_bytes, down to evict_to * max_bytes
+    # so the directory scan of an eviction runs once per (1 - evict_to) * max_bytes written, not on every write
+    def __init__(self,
+                 cache_dir: str = '.statsperform_cache',
+                 max_bytes: int = 2 * 1024 ** 3,
+                 feed_ttls: dict = None,
+                 evict_to: float = 0.9):
+        assert 0 <= evict_to < 1, "evict_to must be a fraction of max_bytes below 1"
+
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.evict_to = evict_to
+        self.feed_ttls = dict(DEFAULT_FEED_TTLS, **(feed_ttls or {}))
+
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # size of the cache directory, only scanned on the first write so opening a big cache stays cheap
+        self._total_bytes = None
+
+    @staticmethod
+    def key(feed_name: str,
+            params: dict) -> str:
+        identity = json.dumps([feed_name, {k: str(v) for k, v in params.items()}], sort_keys=True)
+        return hashlib.sha256(identity.encode('utf-8')).hexdigest()
+
+    def _path(self,
+              key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f'{key}.json')
+
+    def _entry_paths(self):
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith('.json'):
+                    yield os.path.join(root, name)
+
+    def get(self,
+            feed_name: str,
+            params: dict,
+            allow_stale: bool = False):
+        path = self._path(self.key(feed_name, params))
+
+        try:
+            with open(path, 'r') as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+        ttl = self.feed_ttls.get(feed_name)
+        expired = not entry['immutable'] and ttl is not None and time.time() - entry['fetched_at'] > ttl
+
+        if expired and not allow_stale:
+            return None
+
+        # mtime doubles as the last access time used for LRU eviction
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+        return entry['payload']
+
+    def put(self,
+            feed_name: str,
+            params: dict,
+            payload,
+            immutable: bool = False):
+        path = self._path(self.key(feed_name, params))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        entry = {
+            'feed_name': feed_name,
+            'params': {k: str(v) for k, v in params.items()},
+            'fetched_at': time.time(),
+            'immutable': immutable,
+            'payload': payload,
+        }
+
+        # write to a temp file and rename so concurrent readers never see a partial entry
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(entry, f)
+
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(os.path.getsize(p) for p in self._entry_paths())
+
+            previous_size = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp_path, path)
+            self._total_bytes += os.path.getsize(path) - previous_size
+
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        entries = sorted(((os.path.getmtime(p), os.path.getsize(p), p) for p in self._entry_paths()))
+        low_water = self.evict_to * self.max_bytes
+
+        for _, size, path in entries:
+            if self._total_bytes <= low_water:
+                break
+            os.remove(path)
+            self._total_bytes -= size
+
+    def clear(self):
+        with self._lock:
+            for path in list(self._entry_paths()):
+                os.remove(path)
+            self._total_bytes = 0
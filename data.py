@@ -1,33 +1,123 @@
 import pandas as pd
-import json
-import subprocess
+import numpy as np
 import config
 import os
-from google.cloud import bigquery as bqc
+import threading
+import time
+from cache import ResponseCache
+from ledger import IngestionLedger
+from schema import compact
+from storage import BigQueryStorage
+from writers import BatchWriter
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+# column position of every stat in the fixed StatsPerform player / team schemas (config.py)
+PLAYER_STAT_INDEX = {stat: i for i, stat in enumerate(config.all_player_match_stats)}
+TEAM_STAT_INDEX = {stat: i for i, stat in enumerate(config.all_team_match_stats)}
+
+
+class RateLimiter:
+    # spaces out calls to a single host so that at most `max_per_second` requests start each second.
+    # shared between worker threads, so acquiring a slot is done under a lock
+    def __init__(self,
+                 max_per_second: float = None):
+        self.min_interval = 1.0 / max_per_second if max_per_second else 0.0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.min_interval:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.min_interval
+
+        if slot > now:
+            time.sleep(slot - now)
+
 
 class DataLoader:
     def __init__(self, 
                  tourney_cal_id: str,
                  load_calendar: bool = True,
-                 bq_project: str = 'prizepicksanalytics'):
+                 bq_project: str = 'prizepicksanalytics',
+                 statsperform_base_url: str = 'https://api.performfeeds.com/soccerdata',
+                 proxy_url: str = 'http://127.0.0.1:3128',
+                 request_timeout: float = 60,
+                 max_retries: int = 5,
+                 http_pool_size: int = 16,
+                 cache_dir: str = '.statsperform_cache',
+                 cache_max_bytes: int = 2 * 1024 ** 3,
+                 offline: bool = False,
+                 ledger_path: str = 'ingestion_ledger.sqlite',
+                 storage=None,
+                 lazy: bool = False):
         
         self.tourney_cal_id = tourney_cal_id
         self.bq_project = bq_project
-
-        self.matches = None
-        self.client = bqc.Client(project=self.bq_project)
-        self._get_all_matches_in_tourneycal(load_calendar)
+        # base url and proxy can be pointed at a local stand-in server serving canned feeds
+        self.statsperform_base_url = statsperform_base_url
+        self.proxy_url = proxy_url
+        self.request_timeout = request_timeout
+        self.max_retries = max_retries
+        self.http_pool_size = http_pool_size
+
+        # responses are cached on disk unless cache_dir is None. offline serves everything from
+        # the cache, ignoring ttls, and fails on anything that was never downloaded
+        self.offline = offline
+        self.cache = ResponseCache(cache_dir, max_bytes=cache_max_bytes) if cache_dir is not None else None
+        assert not (offline and self.cache is None), "Offline mode needs a cache_dir to serve responses from."
+
+        # the ingestion ledger is opened by each backfill, for the storage it writes to
+        self.ledger_path = ledger_path
+        self.session = None
+        self._client = None
+        self._matches = None
+        # where match data tables are read from and written to. BigQuery by default, a
+        # storage.ParquetStorage runs everything locally under the same table names
+        self.storage = storage if storage is not None else BigQueryStorage(self.bq_project, get_client=self._get_bq_client)
+
+        # lazy defers the bq client, the calendar fetch / upload and the google / requests imports until
+        # first use, so scripts that only read cached data or the model start quickly
+        self.lazy = lazy
+        self.load_calendar = load_calendar
+
+        if not lazy:
+            # local storages never need the client, BigQueryStorage gets it on first query otherwise
+            if isinstance(self.storage, BigQueryStorage):
+                self._get_bq_client()
+            self._get_all_matches_in_tourneycal(load_calendar)
+
+
+    @property
+    def client(self):
+        return self._get_bq_client()
+
+    # MA1 calendar of the tournament, fetched on first access when the loader is lazy
+    @property
+    def matches(self) -> pd.DataFrame:
+        if self._matches is None and self.lazy:
+            self._get_all_matches_in_tourneycal(self.load_calendar)
+        return self._matches
+
+    @matches.setter
+    def matches(self, matches: pd.DataFrame):
+        self._matches = matches
 
         
 
     def _access_statsperform_api(self,
                                 feed_name: str,
-                                match_id: str = None
+                                match_id: str = None,
+                                use_cache: bool = True
                                 ):
 
-        proxy_url = "http://127.0.0.1:3128"
-        statsperform_base_url = 'https://api.performfeeds.com/soccerdata'
-        auth_key = str(os.environ['STATSPERFORM_API_KEY'])
+        proxy_url = self.proxy_url
+        statsperform_base_url = self.statsperform_base_url
 
         master_dict = {
             '_rt':'b',
@@ -44,23 +134,76 @@ class DataLoader:
             master_dict['detailed'] = 'yes'
             master_dict['people'] = 'yes'
 
-        query_string = '&'.join([f'{k}={v}' for k, v in master_dict.items()])
+        if self.cache is not None and (use_cache or self.offline):
+            cached = self.cache.get(feed_name, master_dict, allow_stale=self.offline)
+            if cached is not None:
+                return cached
+
+        if self.offline:
+            raise LookupError(f"No cached {feed_name} response for {master_dict} and the loader is offline.")
+
+        auth_key = str(os.environ['STATSPERFORM_API_KEY'])
+
+        url = f'{statsperform_base_url}/{feed_name}/{auth_key}/authorized' if feed_name == 'tournamentcalendar' else \
+            f'{statsperform_base_url}/{feed_name}/{auth_key}'
+
+        if self.session is None:
+            self.session = self._create_http_session(proxy_url)
+
+        response = self.session.get(url,
+                                    params=master_dict,
+                                    timeout=self.request_timeout)
+        response.raise_for_status()
 
-        q_command = f""" curl -x "{proxy_url}" '{statsperform_base_url}/{feed_name}/{auth_key}/authorized?&{query_string}' """ if feed_name == 'tournamentcalendar' else \
-            f""" curl -x "{proxy_url}" '{statsperform_base_url}/{feed_name}/{auth_key}?&{query_string}' """
+        json_output = response.json()
 
-        process = subprocess.run(
-                    q_command,
-                    shell=True,
-                    capture_output=True,
-                    check=False # Set to True if you want a CalledProcessError for non-zero exit codes
-                )
+        if self.cache is not None:
+            self.cache.put(feed_name, master_dict, json_output,
+                           immutable=self._is_final_response(feed_name, json_output))
 
-        stdout = process.stdout
-        json_output = json.loads(stdout)
         return json_output
 
 
+    # stats of a match that has been played never change, so those responses can be cached forever
+    @staticmethod
+    def _is_final_response(feed_name: str,
+                           json_output) -> bool:
+        if feed_name != 'matchstats':
+            return False
+
+        match_details = json_output.get('liveData', {}).get('matchDetails', {})
+        return match_details.get('matchStatus') == 'Played'
+
+
+    # keep-alive session shared by every feed call (and every fetch thread), so the proxy CONNECT and
+    # TLS handshake are paid once per pooled connection instead of once per request
+    def _create_http_session(self,
+                             proxy_url: str = None):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        retry = Retry(total=self.max_retries,
+                      backoff_factor=0.5,
+                      status_forcelist=[429, 500, 502, 503, 504],
+                      allowed_methods=['GET'],
+                      respect_retry_after_header=True,
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1,
+                              pool_maxsize=self.http_pool_size,
+                              max_retries=retry)
+
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+
+        if proxy_url:
+            session.proxies = {'http': proxy_url, 'https': proxy_url}
+
+        return session
+
+
 
     def load_competitions(self,
                         to_bq=False):
@@ -78,11 +221,9 @@ class DataLoader:
                                     
         if to_bq:
             try:
-                final_df.to_gbq('soccer_simulations.tourneycal_data',
-                        self.bq_project,
-                        if_exists='fail')
+                self.storage.write_table('tourneycal_data', final_df, if_exists='fail')
             except Exception as e:
-                print("Table already exists on BQ!")
+                print(f"Table tourneycal_data already exists in {self.storage}!")
 
         return final_df
 
@@ -99,12 +240,10 @@ class DataLoader:
 
         if to_bq:
             try:
-                final_squad.to_gbq('soccer_simulations.squad_data',
-                                self.bq_project,
-                                if_exists='fail')
+                self.storage.write_table('squad_data', final_squad, if_exists='fail')
                 
             except Exception as e:
-                print('Table already exists!')
+                print(f"Table squad_data already exists in {self.storage}!")
         
         return final_squad
 
@@ -126,11 +265,9 @@ class DataLoader:
 
         if load_calendar:
             try:
-                self.matches.to_gbq('soccer_simulations.match_calendar',
-                        self.bq_project,
-                        if_exists='fail')
+                self.storage.write_table('match_calendar', self.matches, if_exists='fail')
             except Exception as e:
-                print("Table already exists on BQ!")
+                print(f"Table match_calendar already exists in {self.storage}!")
 
 
 
@@ -139,73 +276,80 @@ class DataLoader:
     def backload_season_data(
                             self,
                             game_limit=None,
-                            table_name: str = f'soccer_simulations.schema_match_data'):
+                            table_name: str = f'soccer_simulations.schema_match_data',
+                            max_workers: int = 1,
+                            max_requests_per_second: float = None,
+                            sink=None,
+                            batch_matches: int = 20,
+                            batch_rows: int = None):
         
         if self.matches is None:
-            self._get_all_matches_in_tourneycal()
+            self._get_all_matches_in_tourneycal(load_calendar=False)
 
-        processed_team_match_ids = []
-        processed_player_match_ids = []
+        # sink: self.storage unless another backend is passed. the ledger only knows about matches
+        # ingested into this sink, backfills into other storages keep their own rows
+        sink = sink if sink is not None else self.storage
+        ledger = IngestionLedger(self.ledger_path, target=sink.location)
 
         try:
-            processed_team_match_ids = self.get_processed_team_match_ids()
-            processed_team_match_ids = list(processed_team_match_ids.match_id.unique())
-        except Exception as e:
-            print('team table doesnt exist')
+            if ledger.is_empty():
+                self._seed_ledger_from_storage(ledger, sink)
 
-        try:
-            processed_player_match_ids = self.get_processed_player_match_ids()
-            processed_player_match_ids = list(processed_player_match_ids.match_id.unique())
-        except Exception as e:
-            print('player table doesnt exist')
+            # only matches that are new, or whose MA1 lastUpdated moved since they were ingested, get fetched
+            new_match_ids, updated_match_ids = ledger.pending_matches(self.matches)
+            updated_match_ids = set(updated_match_ids)
+            pending_match_ids = updated_match_ids.union(new_match_ids)
+            list_of_matches = [x for x in self.matches.id.unique() if x in pending_match_ids]
 
-        list_of_matches = self.matches.id.unique()
-        processed_matches = list(set(processed_team_match_ids) & set(processed_player_match_ids))
-        list_of_matches = [x for x in list_of_matches if x not in processed_matches]
+            if game_limit:
+                list_of_matches = list_of_matches[:game_limit]
 
-        if game_limit:
-            list_of_matches = list_of_matches[:game_limit]
+            last_updated = dict(zip(self.matches.id, self.matches.lastUpdated))
+            payload_hashes = ledger.payload_hashes()
 
-        all_teams = []
-        all_players = []
+            team_table, player_table = table_name.replace('schema', 'team'), table_name.replace('schema', 'player')
 
-        for i, id in enumerate(list_of_matches):
+            # rows are streamed to the sink every `batch_matches` matches / `batch_rows` rows, and the ledger only
+            # records a match once its batch landed
+            writer = BatchWriter(sink,
+                                 max_matches=batch_matches,
+                                 max_rows=batch_rows,
+                                 on_flush=ledger.record)
 
-            if id in processed_team_match_ids and id in processed_player_match_ids:
-                continue
+            # MA2 payloads are downloaded by a pool of at most `max_workers` in-flight requests,
+            # aggregation stays on this thread and runs in match order as payloads arrive.
+            # updated matches bypass the response cache, which would otherwise serve the old payload
+            game_stats_iter = self.fetch_game_stats(list_of_matches,
+                                                    max_workers=max_workers,
+                                                    max_requests_per_second=max_requests_per_second,
+                                                    refresh_ids=updated_match_ids)
 
-            game_stats = None
+            for i, (id, game_stats) in enumerate(game_stats_iter):
 
-            if id not in processed_team_match_ids:
+                if game_stats is None:
+                    continue
 
-                print(f"Now processing team match stats #{i}: {id}")
-                game_stats = self.get_game_stats(id)
-                team_stats = self._aggregate_team_data(game_stats)
-                all_teams.append(team_stats)
-                
-            if id not in processed_player_match_ids:
-                if game_stats == None:
-                    game_stats = self.get_game_stats(id)
+                payload_hash = ledger.payload_hash(game_stats)
+                ledger_row = (id, self.tourney_cal_id, last_updated[id], payload_hash)
 
-                print(f"Now processing player match stats #{i}: {id}")
-                player_stats = self._aggregate_player_data(game_stats)
-                all_players.append(player_stats)
-            
+                # lastUpdated moved but the stats didn't change, nothing to rewrite
+                if payload_hashes.get(id) == payload_hash:
+                    writer.record(ledger_row)
+                    continue
 
+                print(f"Now processing match stats #{i}: {id}")
+                writer.add(id,
+                           {team_table: self._aggregate_team_data(game_stats),
+                            player_table: self._aggregate_player_data(game_stats)},
+                           ledger_row=ledger_row,
+                           replace=id in updated_match_ids)
 
-        if all_teams :
-            team_data_to_bq = pd.concat(all_teams, axis=0, ignore_index=True)
-            team_data_to_bq.to_gbq(table_name.replace('schema', 'team'),
-                    self.bq_project,
-                    if_exists='append')
-            
-        if all_players:
-            player_data_to_bq = pd.concat(all_players, axis=0, ignore_index=True)
-            player_data_to_bq.to_gbq(table_name.replace('schema', 'player'),
-                    self.bq_project,
-                    if_exists='append')
-            
-        print(f"Data Uploaded for the following Game Ids: {list_of_matches}")
+            writer.flush()
+
+        finally:
+            ledger.close()
+
+        print(f"Data Uploaded for the following Game Ids: {writer.flushed_match_ids}")
         #     return team, player
         # else:
         #     return None, None
@@ -213,18 +357,138 @@ class DataLoader:
 
     # calls statsperform api to get stats of one game then calculates team and player data.
     def get_game_stats(self,
-                       match_id):
+                       match_id,
+                       use_cache: bool = True):
         
         match_data = self._access_statsperform_api(feed_name='matchstats',
-                            match_id=match_id)
+                            match_id=match_id,
+                            use_cache=use_cache)
                 
         return match_data
 
 
+    # first run with a ledger: treat matches already in both match tables of the storage as ingested at their
+    # current lastUpdated
+    def _seed_ledger_from_storage(self,
+                                  ledger,
+                                  storage):
+        try:
+            processed_team_match_ids = storage.distinct_match_ids('team_match_data')
+            processed_player_match_ids = storage.distinct_match_ids('player_match_data')
+        except Exception as e:
+            print('match data tables dont exist')
+            return
+
+        processed_matches = processed_team_match_ids & processed_player_match_ids
+        ledger.record([(match_id, self.tourney_cal_id, last_updated, None)
+                       for match_id, last_updated in zip(self.matches.id, self.matches.lastUpdated)
+                       if match_id in processed_matches])
+
+
+    # downloads MA2 stats for many games with a bounded thread pool, yielding (match_id, stats) in the order given.
+    # matches whose download fails are yielded with None so the caller can pick them up on the next run
+    def fetch_game_stats(self,
+                         match_ids,
+                         max_workers: int = 1,
+                         max_requests_per_second: float = None,
+                         refresh_ids=None):
+
+        refresh_ids = set(refresh_ids or [])
+        rate_limiter = RateLimiter(max_requests_per_second)
+
+        # create the shared session up front rather than racing to create it from the worker threads
+        if self.session is None and not self.offline:
+            self.session = self._create_http_session(self.proxy_url)
+
+        def fetch(match_id):
+            rate_limiter.wait()
+            try:
+                return self.get_game_stats(match_id, use_cache=match_id not in refresh_ids)
+            except Exception as e:
+                print(f"Failed to fetch match stats for {match_id}: {e}")
+                return None
+
+        # at most 2 * max_workers payloads are queued or held at once, so memory doesn't grow with the number of games
+        max_workers = max(1, max_workers)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            in_flight = deque()
+            for match_id in match_ids:
+                in_flight.append((match_id, executor.submit(fetch, match_id)))
+                if len(in_flight) >= 2 * max_workers:
+                    done_id, future = in_flight.popleft()
+                    yield done_id, future.result()
+
+            while in_flight:
+                done_id, future = in_flight.popleft()
+                yield done_id, future.result()
+
+
     # method to aggregate team data
 
     def _aggregate_team_data(self,
                              match_stats):
+        # return dataframe of len == 2 with rows representing both teams, sharing the same game_id.
+        # kept in the stored column types, it is written out straight away
+        return self._aggregate_team_rows([match_stats])
+
+
+    # aggregates team data of many MA2 payloads (e.g. a whole season) into a single dataframe,
+    # in the compact dtypes of schema.py (int16 / bool / float32 stats, categorical ids, parsed match_date)
+    def aggregate_team_data_batch(self,
+                                  list_of_match_stats) -> pd.DataFrame:
+        return compact(self._aggregate_team_rows(list_of_match_stats))
+
+
+    # stats are written straight into one preallocated matrix, so the table is constructed once
+    def _aggregate_team_rows(self,
+                             list_of_match_stats) -> pd.DataFrame:
+
+        n_rows = sum(len(match_stats['liveData']['lineUp']) for match_stats in list_of_match_stats)
+
+        # stats missing from a team's payload stay 0 to keep the StatsPerform schema (config.py)
+        stats = np.zeros((n_rows, len(TEAM_STAT_INDEX)))
+        meta = {col: [] for col in ['competition_id', 'competition_name', 'tourney_cal_id', 'tourney_cal_name',
+                                    'match_id', 'match_date', 'team_id', 'team_name', 'opponent_id', 'home']}
+        formations = []
+
+        row = 0
+        for match_stats in list_of_match_stats:
+            match_info = match_stats['matchInfo']
+            competitors = match_info['contestant']
+
+            for team in match_stats['liveData']['lineUp']:
+                competitor = competitors[0] if competitors[0]['id'] == team['contestantId'] else competitors[1]
+                opponent = competitors[0] if competitors[0]['id'] != team['contestantId'] else competitors[1]
+
+                meta['competition_id'].append(match_info['competition']['id'])
+                meta['competition_name'].append(match_info['competition']['name'])
+                meta['tourney_cal_id'].append(match_info['tournamentCalendar']['id'])
+                meta['tourney_cal_name'].append(match_info['tournamentCalendar']['name'])
+                meta['match_id'].append(match_info['id'])
+                meta['match_date'].append(match_info['date'])
+                meta['team_id'].append(str(competitor['id']))
+                meta['team_name'].append(str(competitor['shortName']))
+                meta['opponent_id'].append(str(opponent['id']))
+                meta['home'].append(competitor['position'] == 'home')
+                formations.append(str(team.get('formationUsed', np.nan)))
+
+                for stat in team.get('stat', []):
+                    col = TEAM_STAT_INDEX.get(stat['type'])
+                    if col is not None:
+                        stats[row, col] = float(stat['value'])
+                row += 1
+
+        teams = pd.concat([pd.DataFrame(meta),
+                           pd.DataFrame(stats, columns=config.all_team_match_stats)], axis=1)
+        teams['formationUsed'] = formations
+
+        return teams
+
+
+    # DEPRECATED!: row-wise implementation of _aggregate_team_data, kept as the baseline for
+    # benchmarks/aggregate_benchmark.py
+    def _aggregate_team_data_legacy(self,
+                                    match_stats):
 
         # collect tournament calendar, competition and team information
         tourney_cal_id, tourney_cal_season = match_stats['matchInfo']['tournamentCalendar']['id'], \
@@ -283,6 +547,85 @@ class DataLoader:
 
     def _aggregate_player_data(self,
                                match_request):
+        match_info = match_request['matchInfo']
+        home_ids = {c['id'] for c in match_info['contestant'] if c['position'] == 'home'}
+        lineups = match_request['liveData']['lineUp']
+
+        n_players = sum(len(team['player']) for team in lineups)
+        minutes_col = PLAYER_STAT_INDEX['minsPlayed']
+
+        # flatten the lineUp / stat json of both teams in one pass into a preallocated stats matrix,
+        # stats missing from a player's payload stay 0 (same as the zero-filled missing columns before)
+        stats = np.zeros((n_players, len(PLAYER_STAT_INDEX)))
+        played = np.zeros(n_players, dtype=bool)
+        rows, cols, values = [], [], []
+        meta = {'team_id': [], 'home': [], 'playerId': [], 'matchName': [], 'position': [], 'positionSide': []}
+
+        row = 0
+        for team in lineups:
+            home = team['contestantId'] in home_ids
+
+            for player in team['player']:
+                meta['team_id'].append(team['contestantId'])
+                meta['home'].append(home)
+                meta['playerId'].append(player['playerId'])
+                meta['matchName'].append(player.get('matchName'))
+                meta['position'].append(player.get('position'))
+                meta['positionSide'].append(player.get('positionSide'))
+
+                for stat in player.get('stat', []):
+                    col = PLAYER_STAT_INDEX.get(stat['type'])
+                    if col is not None:
+                        rows.append(row)
+                        cols.append(col)
+                        values.append(float(stat['value']))
+                        # players without a minsPlayed stat didn't play and are dropped
+                        if col == minutes_col:
+                            played[row] = True
+                row += 1
+
+        stats[rows, cols] = values
+        stats = stats[played]
+        meta = {k: np.array(v, dtype=object)[played] for k, v in meta.items()}
+        meta['isSub'] = meta['position'] == 'Substitute'
+
+        # substitutes inherit position info from the player they came on for: a hash join of
+        # playerOnId -> playerOffId -> row, then pointer jumping for subs that replaced another sub
+        row_of = {player_id: i for i, player_id in enumerate(meta['playerId'])}
+        off_of = {sub['playerOnId']: sub['playerOffId'] for sub in match_request['liveData'].get('substitute', [])}
+
+        source = np.arange(len(meta['playerId']))
+        for i in np.flatnonzero(meta['isSub']):
+            off_row = row_of.get(off_of.get(meta['playerId'][i]))
+            if off_row is not None:
+                source[i] = off_row
+
+        for _ in range(len(off_of)):
+            next_source = source[source]
+            if (next_source == source).all():
+                break
+            source = next_source
+
+        meta['position'] = meta['position'][source]
+        meta['positionSide'] = meta['positionSide'][source]
+        formation_col = PLAYER_STAT_INDEX['formationPlace']
+        stats[:, formation_col] = stats[source, formation_col]
+
+        config_cols = ['match_id', 'match_date', 'team_id', 'home', 'playerId', 'matchName', 'position', 'positionSide', 'isSub']
+
+        meta['match_id'] = match_info['id']
+        meta['match_date'] = match_info['date']
+        meta['home'] = meta['home'].astype(bool)
+        players = pd.DataFrame(meta, columns=config_cols).fillna(0)
+
+        # return dataframe of all players with their statistics
+        return pd.concat([players, pd.DataFrame(stats, columns=config.all_player_match_stats)], axis=1)
+
+
+    # DEPRECATED!: row-wise implementation of _aggregate_player_data, kept as the baseline for
+    # benchmarks/aggregate_benchmark.py
+    def _aggregate_player_data_legacy(self,
+                                      match_request):
         match_data = pd.DataFrame(match_request['liveData']['lineUp'])
 
         subs = pd.DataFrame(match_request['liveData']['substitute']).set_index('playerOnId').to_dict('index')
@@ -342,23 +685,40 @@ class DataLoader:
         return pd.concat(list_of_dfs, axis=0, ignore_index=True).fillna(0)
         
 
-    def get_processed_team_match_ids(self):
-        team_query = """
-            select distinct match_id
-            from prizepicksanalytics.soccer_simulations.team_match_data
-        """
+    def get_processed_team_match_ids(self) -> set:
+        return self.storage.distinct_match_ids('team_match_data')
 
-        return self.execute_bq_query(team_query)    
+
+    def get_processed_player_match_ids(self) -> set:
+        return self.storage.distinct_match_ids('player_match_data')
 
 
-    def get_processed_player_match_ids(self):
-        player_query = """
-            select distinct match_id
-            from prizepicksanalytics.soccer_simulations.player_match_data
-        """
 
-        return self.execute_bq_query(player_query)
+    # historic team, player and squad rows for a set of calendar matches (rows with home_id, away_id and localDate)
+    # with one parameterised read per table, instead of separate home / away queries for every match.
+    # team and player rows are returned sorted and indexed by (team_id, match_date), squads by contestantId,
+    # all in the compact dtypes of schema.py.
+    # rows of the matches themselves are included, callers keep only rows before each match's date
+    def load_historic_data(self,
+                           matches: pd.DataFrame):
+        team_ids = sorted(set(matches.home_id) | set(matches.away_id))
+        # match_date is stored as 'YYYY-MM-DDZ', so this bound keeps every match up to and including the last match day
+        date_bound = ('match_date', '<=', f'{matches.localDate.max()}Z')
 
+        squad_data = self.storage.read_table('squad_data',
+                                             filters=[('contestantId', 'in', team_ids)])
+
+        team_data = self.storage.read_table('team_match_data',
+                                            filters=[('team_id', 'in', team_ids), date_bound])
+
+        # players of these squads wherever they played before, plus anyone who played for these teams
+        player_data = self.storage.read_table('player_match_data',
+                                              filters=[[('playerId', 'in', sorted(set(squad_data.id))), date_bound],
+                                                       [('team_id', 'in', team_ids), date_bound]])
+
+        return compact(team_data).set_index(['team_id', 'match_date']).sort_index(), \
+            compact(player_data).set_index(['team_id', 'match_date']).sort_index(), \
+            compact(squad_data).set_index('contestantId').sort_index()
 
 
     # DEPRECATED!: DataFrame should be of only one match
@@ -397,17 +757,30 @@ class DataLoader:
 
         return dataframe
 
+    def _get_bq_client(self):
+        if self._client is None:
+            from google.cloud import bigquery as bqc
+            self._client = bqc.Client(project=self.bq_project)
+        return self._client
+
     def execute_bq_query(self,
-                        query: str) -> pd.DataFrame:
-        if self.client is None:
-            self.client = bqc.Client(project=self.bq_project)
+                        query: str,
+                        query_parameters: list = None) -> pd.DataFrame:
+        from google.cloud import bigquery as bqc
 
-        query_results = self.client.query(query)
+        job_config = bqc.QueryJobConfig(query_parameters=query_parameters) if query_parameters else None
+        query_results = self._get_bq_client().query(query, job_config=job_config)
         data = query_results.to_dataframe()
         return data
     
     def close_bq_client(self):
-        self.client.close()
-        self.client = None
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    def close_http_session(self):
+        if self.session is not None:
+            self.session.close()
+            self.session = None
     
 
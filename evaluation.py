@@ -0,0 +1,198 @@
+import numpy as np
+import pandas as pd
+from scipy.special import gammaln
+from scipy.stats import norm
+
+
+# rows scored per block by the discrete CRPS, bounds the (rows x support) cdf matrices
+CRPS_CHUNK_SIZE = 20000
+# minutes played buckets of the grouped breakdowns, the last one is open ended
+MINUTES_BUCKETS = (0, 30, 60, 75, 90)
+
+
+def _array(values) -> np.ndarray:
+    return np.asarray(values, dtype=float)
+
+
+def normal_nll(y_true,
+               mu,
+               sigma) -> np.ndarray:
+    return -norm.logpdf(_array(y_true), loc=_array(mu), scale=_array(sigma))
+
+
+def _negative_binomial_p(mu: np.ndarray,
+                         r: np.ndarray) -> np.ndarray:
+    # (mean, dispersion) -> success probability of scipy's nbinom(n=r, p), clipped as in the notebook
+    return np.clip(r / (mu + r), 1e-16, 1.0 - 1e-16)
+
+
+def negative_binomial_nll(y_true,
+                          mu,
+                          r) -> np.ndarray:
+    # same values as -scipy.stats.nbinom.logpmf(y, n=r, p=r / (mu + r)) per row, in closed form over whole arrays
+    y_true, mu, r = np.floor(_array(y_true)), _array(mu), _array(r)
+    p = _negative_binomial_p(mu, r)
+    log_pmf = gammaln(y_true + r) - gammaln(r) - gammaln(y_true + 1) + r * np.log(p) + y_true * np.log1p(-p)
+    return -log_pmf
+
+
+def _class_index(y_true,
+                 classes) -> np.ndarray:
+    # position of each label in the ordered class values, labels are the positions themselves when classes is None
+    if classes is None:
+        return _array(y_true).astype(int)
+    classes = _array(classes)
+    index = np.searchsorted(classes, _array(y_true))
+    assert np.all(classes[np.minimum(index, len(classes) - 1)] == _array(y_true)), "Labels missing from classes"
+    return index
+
+
+def ordinal_nll(y_true,
+                probas: np.ndarray,
+                classes=None) -> np.ndarray:
+    # probas: (rows x classes) as returned by LGBMOrdinal.predict_proba, clipped like ordinal_logistic_nll
+    probas = np.asarray(probas, dtype=float)
+    label_probas = probas[np.arange(probas.shape[0]), _class_index(y_true, classes)]
+    return -np.log(np.clip(label_probas, np.finfo(float).eps, 1.0))
+
+
+def normal_crps(y_true,
+                mu,
+                sigma) -> np.ndarray:
+    # closed form CRPS of a normal forecast
+    sigma = _array(sigma)
+    z = (_array(y_true) - _array(mu)) / sigma
+    return sigma * (z * (2 * norm.cdf(z) - 1) + 2 * norm.pdf(z) - 1 / np.sqrt(np.pi))
+
+
+def _discrete_crps(cdf: np.ndarray,
+                   y_index: np.ndarray,
+                   widths: np.ndarray) -> np.ndarray:
+    # sum over the support of (F(k) - 1{y <= k})^2, each step weighted by the distance to the next support point
+    observed = np.arange(cdf.shape[1])[np.newaxis, :] >= y_index[:, np.newaxis]
+    return ((cdf - observed) ** 2 * widths).sum(axis=1)
+
+
+def negative_binomial_crps(y_true,
+                           mu,
+                           r,
+                           tail_sds: float = 8.0) -> np.ndarray:
+    # CRPS over the counts 0..K, K covering the observed value and tail_sds standard deviations above the mean.
+    # pmfs come from the recurrence pmf(k) = pmf(k - 1) * (k - 1 + r) / k * (1 - p), in log space. rows are
+    # scored in blocks of similar K so a few wide distributions don't widen every block
+    y_true, mu, r = np.floor(_array(y_true)), _array(mu), _array(r)
+    p = _negative_binomial_p(mu, r)
+    supports = np.maximum(y_true, mu + tail_sds * np.sqrt(mu / p)).astype(int) + 1
+    order = np.argsort(supports, kind='stable')
+    crps = np.empty(y_true.shape[0])
+
+    for start in range(0, y_true.shape[0], CRPS_CHUNK_SIZE):
+        rows = order[start:start + CRPS_CHUNK_SIZE]
+        support = supports[rows].max()
+
+        k = np.arange(1, support)[np.newaxis, :]
+        log_steps = np.log(k - 1 + r[rows, np.newaxis]) - np.log(k) + np.log1p(-p[rows, np.newaxis])
+        log_pmf = np.concatenate([(r[rows] * np.log(p[rows]))[:, np.newaxis], log_steps], axis=1).cumsum(axis=1)
+        cdf = np.minimum(np.exp(log_pmf).cumsum(axis=1), 1.0)
+
+        crps[rows] = _discrete_crps(cdf, y_true[rows].astype(int), np.ones(support))
+
+    return crps
+
+
+def ordinal_crps(y_true,
+                 probas: np.ndarray,
+                 classes=None) -> np.ndarray:
+    # CRPS of the class probabilities of LGBMOrdinal, in units of the class values (unit steps when classes is None)
+    probas = np.asarray(probas, dtype=float)
+    widths = np.ones(probas.shape[1]) if classes is None else np.append(np.diff(_array(classes)), 0.0)
+    cdf = np.minimum(probas.cumsum(axis=1), 1.0)
+    return _discrete_crps(cdf, _class_index(y_true, classes), widths)
+
+
+def ordinal_mean(probas: np.ndarray,
+                 classes=None) -> np.ndarray:
+    # expected class value, the point prediction of LGBMOrdinal for errors and over / under picks
+    probas = np.asarray(probas, dtype=float)
+    classes = np.arange(probas.shape[1]) if classes is None else _array(classes)
+    return probas @ classes
+
+
+def mae(y_true,
+        y_pred) -> float:
+    return float(np.mean(np.abs(_array(y_true) - _array(y_pred))))
+
+
+def rmse(y_true,
+         y_pred) -> float:
+    return float(np.sqrt(np.mean((_array(y_true) - _array(y_pred)) ** 2)))
+
+
+def over_under(y_true,
+               line,
+               prediction,
+               min_edge: float = 0.0) -> tuple:
+    # (picked, hit) per row: over when the prediction is above the line, under when below. rows where the
+    # prediction is within min_edge of the line aren't picked, pushes (result equal to the line) aren't graded
+    y_true, line, prediction = _array(y_true), _array(line), _array(prediction)
+    edge = prediction - line
+    picked = (np.abs(edge) > min_edge) & (edge != 0) & (y_true != line) & ~np.isnan(line)
+    hit = picked & (np.sign(edge) == np.sign(y_true - line))
+    return picked, hit
+
+
+def minutes_bucket(minutes,
+                   edges: tuple = MINUTES_BUCKETS) -> pd.Categorical:
+    # e.g. 0-30, 30-60, 60-75, 75-90, 90+
+    labels = [f'{low}-{high}' for low, high in zip(edges[:-1], edges[1:])] + [f'{edges[-1]}+']
+    return pd.cut(_array(minutes), bins=list(edges) + [np.inf], labels=labels, right=False)
+
+
+def score_rows(y_true,
+               y_pred,
+               nll=None,
+               crps=None,
+               line=None,
+               min_edge: float = 0.0) -> pd.DataFrame:
+    # per row errors of a point prediction, with the row NLL / CRPS of its distribution and over / under picks
+    # against a line when given. summarize() aggregates them, overall or per group
+    y_true, y_pred = _array(y_true), _array(y_pred)
+    rows = pd.DataFrame({
+        'error': y_true - y_pred,
+        'abs_error': np.abs(y_true - y_pred),
+        'sq_error': (y_true - y_pred) ** 2,
+        'nll': np.nan if nll is None else _array(nll),
+        'crps': np.nan if crps is None else _array(crps),
+    })
+
+    if line is not None:
+        rows['picked'], rows['hit'] = over_under(y_true, line, y_pred, min_edge=min_edge)
+    else:
+        rows['picked'], rows['hit'] = False, False
+
+    return rows
+
+
+def summarize(rows: pd.DataFrame,
+              by=None) -> pd.DataFrame:
+    # n, MAE, RMSE, bias, mean NLL / CRPS and hit rate of score_rows() output. by: None for one overall row, or
+    # anything DataFrame.groupby takes aligned with the rows, e.g. test.player_position.values or
+    # [test.team_id.values, minutes_bucket(test.p_avg_minsPlayed)]
+    grouped = rows.groupby(by if by is not None else np.zeros(rows.shape[0], dtype=int), observed=True, sort=True)
+    means = grouped[['error', 'abs_error', 'sq_error', 'nll', 'crps']].mean()
+    picks = grouped[['picked', 'hit']].sum()
+
+    summary = pd.DataFrame({
+        'n': grouped.size(),
+        'mae': means.abs_error,
+        'rmse': np.sqrt(means.sq_error),
+        'bias': means.error,
+        'nll': means.nll,
+        'crps': means.crps,
+        'n_picks': picks.picked.astype(int),
+        'hit_rate': picks.hit / picks.picked.where(picks.picked > 0),
+    })
+
+    if by is None:
+        return summary.reset_index(drop=True)
+    return summary
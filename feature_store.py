@@ -0,0 +1,81 @@
+import os
+
+import pandas as pd
+
+from features import FeatureEngine
+from schema import compact
+from storage import ParquetStorage
+
+
+# columns a feature row is keyed by within a feature version
+FEATURE_KEY = ['player_id', 'match_id']
+
+
+class FeatureStore:
+    # feature rows persisted per feature version, keyed by (player_id, match_id):
+    # <root_dir>/<feature_version>/part-*.parquet, one part per write.
+    # tracks which matches are materialized so a new matchweek only computes its own rows, and reads are
+    # column projected / filtered (e.g. on match_date or match_week) without loading the whole version
+    def __init__(self,
+                 root_dir: str = 'feature_store'):
+        self.root_dir = root_dir
+        self.storage = ParquetStorage(root_dir)
+
+    def versions(self) -> list:
+        if not os.path.isdir(self.root_dir):
+            return []
+        return sorted(name for name in os.listdir(self.root_dir) if self.storage._part_paths(name))
+
+    def materialized_match_ids(self,
+                               feature_version: str) -> set:
+        if not self.storage._part_paths(feature_version):
+            return set()
+        return self.storage.distinct_match_ids(feature_version)
+
+    def write(self,
+              feature_version: str,
+              features: pd.DataFrame):
+        # rows of matches already in the version are replaced, not duplicated
+        if features.shape[0] == 0:
+            return
+
+        features = features.drop_duplicates(FEATURE_KEY, keep='last')
+        materialized = self.materialized_match_ids(feature_version) & set(features.match_id)
+        if materialized:
+            self.storage.delete_matches(feature_version, materialized)
+
+        # categorical columns are written as plain strings and compacted again on read. parquet stores categoricals
+        # as dictionaries with int8 or int16 indices depending on how many categories a write has, and the parts
+        # of a version are read as one dataset with the schema of whichever part comes first
+        features = compact(features)
+        labels = [column for column, dtype in features.dtypes.items() if isinstance(dtype, pd.CategoricalDtype)]
+        self.storage.append(feature_version, features.astype({column: 'string' for column in labels}))
+
+    def read(self,
+             feature_version: str,
+             columns: list = None,
+             filters: list = None) -> pd.DataFrame:
+        # filters use the storage.py format, e.g. [('match_week', '>=', 20)] or
+        # [('match_date', '<', pd.Timestamp('2025-03-01'))]. rows come back in the compact dtypes of schema.py
+        return compact(self.storage.read_table(feature_version, columns=columns, filters=filters))
+
+    def update(self,
+               feature_version: str,
+               engine: FeatureEngine,
+               calendar: pd.DataFrame,
+               training: bool = True) -> pd.DataFrame:
+        # computes and stores features for the calendar's matches not materialized yet, returns the new rows.
+        # matches without player rows (not played / not ingested yet) produce nothing and are picked up later
+        materialized = self.materialized_match_ids(feature_version)
+        pending = calendar[~calendar.id.isin(materialized)]
+
+        if pending.shape[0] == 0:
+            print(f"All {calendar.shape[0]} matches already materialized in {feature_version}")
+            return pd.DataFrame()
+
+        features = engine.build(pending, training=training)
+        self.write(feature_version, features)
+
+        print(f"Materialized {features.match_id.nunique() if features.shape[0] else 0} "
+              f"of {pending.shape[0]} pending matches in {feature_version}")
+        return features
@@ -0,0 +1,549 @@
+import os
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from rosters import RosterIndex
+
+
+def gaussian_weight(historic_possession, predicted_next_possession, bandwidth=20.0):
+    """
+    Calculates a Gaussian weight based on the similarity of possession percentages.
+    Bandwidth (sigma) controls how quickly the weight drops off.
+    """
+    difference = historic_possession - predicted_next_possession
+    # Larger bandwidth means less sensitive to differences
+    return np.exp(-(difference**2) / (2 * bandwidth**2))
+
+
+def _to_days(dates) -> np.ndarray:
+    # match_date ('YYYY-MM-DDZ' strings or datetimes) / localDate ('YYYY-MM-DD') as datetime64[D]
+    dates = pd.Series(dates)
+    if pd.api.types.is_datetime64_any_dtype(dates):
+        return dates.dt.tz_localize(None).to_numpy().astype('datetime64[D]') if dates.dt.tz is not None \
+            else dates.to_numpy().astype('datetime64[D]')
+    return dates.astype(str).str[:10].to_numpy().astype('datetime64[D]')
+
+
+def _sum(values: np.ndarray) -> float:
+    # pandas' skipna sum: missing values count as 0, summed in row order
+    return np.where(np.isnan(values), 0, values).sum()
+
+
+def _std(values: np.ndarray) -> float:
+    # pandas' sample standard deviation (ddof=1), NaN below two values
+    if len(values) < 2:
+        return np.nan
+    return np.sqrt(((values - values.sum() / len(values)) ** 2).sum() / (len(values) - 1))
+
+
+class HistoryIndex:
+    # rows of a match table sorted by (entity, match date), with dates parsed once.
+    # every entity's rows are one contiguous slice, so "all rows of entity E strictly before date D"
+    # is a dict lookup plus a binary search instead of a scan of the whole table
+    def __init__(self,
+                 data: pd.DataFrame,
+                 entity_col: str,
+                 date_col: str = 'match_date'):
+        days = _to_days(data[date_col])
+        entities = data[entity_col].to_numpy()
+
+        # stable, so rows of an entity on the same day keep their order in `data`
+        order = np.lexsort((days, pd.factorize(entities)[0]))
+        self.data = data.iloc[order].reset_index(drop=True)
+        self.days = days[order]
+
+        entities = entities[order]
+        starts = np.flatnonzero(np.r_[True, entities[1:] != entities[:-1]])
+        ends = np.r_[starts[1:], len(entities)]
+        self.slices = {entities[start]: (start, end) for start, end in zip(starts, ends)}
+
+    def column(self,
+               name: str) -> np.ndarray:
+        return self.data[name].to_numpy()
+
+    def before(self,
+               entity,
+               date) -> slice:
+        # positions of the entity's rows strictly before `date`
+        start, end = self.slices.get(entity, (0, 0))
+        stop = start + np.searchsorted(self.days[start:end], np.datetime64(date, 'D'), side='left')
+        return slice(start, stop)
+
+
+class RollingPlayerStats:
+    # pre-match aggregates of every row of a player HistoryIndex, from one walk over each player's rows in date order.
+    # keeps a running count and sums, Welford's mean / M2 for the passes variance and a ring buffer of the last
+    # `last_n` rows, so the state for a row only ever covers the player's rows of earlier days
+    def __init__(self,
+                 players: HistoryIndex,
+                 last_n: int = 5):
+        passes = players.column('totalPass').astype(float)
+        minutes = players.column('minsPlayed').astype(float)
+        match_ids = players.column('match_id')
+        n_rows = len(passes)
+
+        self.count = np.zeros(n_rows, dtype=int)
+        self.passes_sum = np.zeros(n_rows)
+        self.passes_m2 = np.zeros(n_rows)
+        self.minutes_sum = np.zeros(n_rows)
+        # (day, match_id, minsPlayed) of the player's last `last_n` rows before each row, oldest first
+        self.recent = [()] * n_rows
+        self.last_n = last_n
+        self.days = players.days
+
+        # missing stats count as 0, like the pandas sums they replace
+        passes = np.where(np.isnan(passes), 0, passes)
+        minutes = np.where(np.isnan(minutes), 0, minutes)
+
+        for start, end in players.slices.values():
+            count, passes_sum, mean, m2, minutes_sum = 0, 0.0, 0.0, 0.0, 0.0
+            ring = deque(maxlen=last_n)
+            pending = []
+
+            for i in range(start, end):
+                # rows of the same day don't see each other
+                if pending and self.days[i] != self.days[pending[-1]]:
+                    for j in pending:
+                        count += 1
+                        passes_sum += passes[j]
+                        delta = passes[j] - mean
+                        mean += delta / count
+                        m2 += delta * (passes[j] - mean)
+                        minutes_sum += minutes[j]
+                        ring.append((self.days[j], match_ids[j], minutes[j]))
+                    pending = []
+
+                self.count[i] = count
+                self.passes_sum[i] = passes_sum
+                self.passes_m2[i] = m2
+                self.minutes_sum[i] = minutes_sum
+                self.recent[i] = tuple(ring)
+                pending.append(i)
+
+        self.rows = dict(zip(zip(players.column('playerId'), match_ids), range(n_rows)))
+
+    def row(self,
+            player_id,
+            match_id,
+            date):
+        # the player's row for this match, when its state is the one of the player's history before `date`
+        i = self.rows.get((player_id, match_id))
+        if i is None or self.days[i] != np.datetime64(date, 'D'):
+            return None
+        return i
+
+    def last_minutes(self,
+                     i: int,
+                     match_ids: set,
+                     since):
+        # minsPlayed of the player's rows in `match_ids`, matches played from day `since` on.
+        # None when the ring buffer may have dropped some of them, i.e. the player featured in more
+        # than `last_n` matches since then (for another team as well)
+        recent = self.recent[i]
+        if not match_ids:
+            return np.array([])
+        if len(recent) == self.last_n and recent[0][0] >= since:
+            return None
+        return np.array([minutes for day, match_id, minutes in recent if match_id in match_ids])
+
+    def stats(self,
+              i: int,
+              weighted_passes: float,
+              last_5_minutes: np.ndarray) -> dict:
+        count = self.count[i]
+
+        return {
+            'p_avg_passes': self.passes_sum[i] / count if count else np.nan,
+            'p_std_passes': np.sqrt(self.passes_m2[i] / (count - 1)) if count > 1 else np.nan,
+            'p_avg_minsPlayed': self.minutes_sum[i] / count if count else np.nan,
+            'p_weighted_passes': weighted_passes,
+            'p_last5_minsPlayed': _sum(last_5_minutes) / len(last_5_minutes) if len(last_5_minutes) else 0
+        }
+
+
+class PossessionKernel:
+    # gaussian possession kernel weighting of a team's earlier matches, for many target matches at once.
+    # for targets j and the team's matches i in date order, W[j, i] = gaussian_weight(possession_i, possession_j,
+    # bandwidth_j) ** 2 where match i was played strictly before target j, else 0. the weighted averages of the
+    # team's possession and of its players' passes are then one matrix product each.
+    # bandwidth: 'std' (sample std of the team's earlier possession, as before), a fixed float, or a
+    # callable(history, mask) returning one bandwidth per target from the team's possession history and the
+    # (targets x matches) strictly-before mask
+    def __init__(self,
+                 teams: HistoryIndex,
+                 players: HistoryIndex,
+                 bandwidth='std'):
+        self.teams = teams
+        self.bandwidth = bandwidth
+        self.possession = teams.column('possessionPercentage').astype(float)
+        team_match_ids = teams.column('match_id')
+
+        # per team, the passes of every player who featured for it in each of its matches (players x matches)
+        self.player_ids, self.passes, self.featured = {}, {}, {}
+        player_rows = pd.DataFrame({'team_id': players.column('team_id'),
+                                    'match_id': players.column('match_id'),
+                                    'playerId': players.column('playerId'),
+                                    'totalPass': players.column('totalPass').astype(float)})
+
+        for team_id, rows in player_rows.groupby('team_id', sort=False):
+            start, end = teams.slices.get(team_id, (0, 0))
+            columns = rows.match_id.map({match_id: k for k, match_id in enumerate(team_match_ids[start:end])})
+            rows = rows[columns.notna()]
+            columns = columns[columns.notna()].to_numpy(dtype=int)
+            codes, player_ids = pd.factorize(rows.playerId)
+
+            passes = np.zeros((len(player_ids), end - start))
+            featured = np.zeros((len(player_ids), end - start))
+            # missing passes count as 0 but the match still weighs in, like the pandas sums
+            np.add.at(passes, (codes, columns), np.nan_to_num(rows.totalPass.to_numpy()))
+            np.add.at(featured, (codes, columns), 1)
+
+            self.player_ids[team_id] = {player_id: k for k, player_id in enumerate(player_ids)}
+            self.passes[team_id] = passes
+            self.featured[team_id] = featured
+
+    def _bandwidths(self,
+                    history: np.ndarray,
+                    mask: np.ndarray) -> np.ndarray:
+        if callable(self.bandwidth):
+            return np.asarray(self.bandwidth(history, mask), dtype=float)
+
+        if self.bandwidth == 'std':
+            count = mask.sum(axis=1)
+            mean = np.where(mask, history, 0).sum(axis=1) / count
+            squares = np.where(mask, (history - mean[:, None]) ** 2, 0).sum(axis=1)
+            # sample std, NaN below two matches
+            return np.where(count > 1, np.sqrt(squares / np.maximum(count - 1, 1)), np.nan)
+
+        return np.full(mask.shape[0], float(self.bandwidth))
+
+    def weights(self,
+                team_id,
+                target_days: np.ndarray,
+                target_possession: np.ndarray) -> np.ndarray:
+        start, end = self.teams.slices.get(team_id, (0, 0))
+        history = self.possession[start:end]
+        mask = self.teams.days[start:end][None, :] < target_days[:, None]
+
+        bandwidths = self._bandwidths(history, mask)
+        weights = gaussian_weight(history[None, :], target_possession[:, None], bandwidths[:, None]) ** 2
+        return np.where(mask, weights, 0)
+
+    def weighted_averages(self,
+                          team_id,
+                          target_days: np.ndarray,
+                          target_possession: np.ndarray):
+        # weighted possession of the team per target, and weighted passes of its players (players x targets)
+        start, end = self.teams.slices.get(team_id, (0, 0))
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            weights = self.weights(team_id, target_days, target_possession)
+            team_weighted = weights @ self.possession[start:end] / weights.sum(axis=1)
+
+            if team_id not in self.passes:
+                return team_weighted, {}, np.empty((0, len(target_days)))
+
+            player_weighted = (self.passes[team_id] @ weights.T) / (self.featured[team_id] @ weights.T)
+
+        return team_weighted, self.player_ids[team_id], player_weighted
+
+
+class FeatureEngine:
+    # point in time features for every player of a match, from team / player histories indexed once.
+    # produces the same rows and columns as get_match_vectors in data_testing.ipynb
+    def __init__(self,
+                 team_data: pd.DataFrame,
+                 player_data: pd.DataFrame,
+                 squads,
+                 bandwidth='std'):
+        self.teams = HistoryIndex(team_data, 'team_id')
+        self.players = HistoryIndex(player_data, 'playerId')
+
+        self.team_possession = self.teams.column('possessionPercentage').astype(float)
+        self.team_match_ids = self.teams.column('match_id')
+        self.player_passes = self.players.column('totalPass').astype(float)
+        self.player_minutes = self.players.column('minsPlayed').astype(float)
+        self.player_match_ids = self.players.column('match_id')
+        self.rolling = RollingPlayerStats(self.players)
+        self.kernel = PossessionKernel(self.teams, self.players, bandwidth=bandwidth)
+
+        # possession of each team in each match, the "cheat" centre of the gaussian kernel
+        self.match_possession = dict(zip(zip(team_data.match_id, team_data.team_id),
+                                         team_data.possessionPercentage.astype(float)))
+
+        # rows of the players who featured for each team in each match, in player_data order
+        self.match_players = {key: rows for key, rows in player_data.groupby(['match_id', 'team_id'],
+                                                                             sort=False, observed=True)}
+
+        # squads: RosterIndex, squad_data rows with contestantId or the squads.pickle dict of team id -> squad
+        self.roster = squads if isinstance(squads, RosterIndex) else RosterIndex(squads)
+
+        # (match_id, team_id) -> (t_posw_possession, {playerId: p_weighted_passes})
+        self._weighted = {}
+
+    def _weight_matches(self,
+                        calendar: pd.DataFrame):
+        # kernel weighted averages of all the calendar's (team, match) pairs, one kernel call per team
+        targets = pd.concat([calendar[['id', 'localDate', 'home_id']].rename(columns={'home_id': 'team_id'}),
+                             calendar[['id', 'localDate', 'away_id']].rename(columns={'away_id': 'team_id'})])
+
+        for team_id, team_targets in targets.groupby('team_id', sort=False, observed=True):
+            match_ids = team_targets.id.to_numpy()
+            # matches not played yet have no possession to centre the kernel on
+            possession = np.array([self.match_possession.get((match_id, team_id), np.nan) for match_id in match_ids])
+
+            team_weighted, player_ids, player_weighted = self.kernel.weighted_averages(
+                team_id, _to_days(team_targets.localDate), possession)
+
+            for j, match_id in enumerate(match_ids):
+                self._weighted[(match_id, team_id)] = (team_weighted[j],
+                                                       {player_id: player_weighted[k, j]
+                                                        for player_id, k in player_ids.items()})
+
+    def _team_history(self,
+                      team_id,
+                      match_id,
+                      date):
+        rows = self.teams.before(team_id, date)
+        history = self.team_possession[rows]
+
+        if (match_id, team_id) not in self._weighted:
+            self._weight_matches(pd.DataFrame({'id': [match_id], 'localDate': [date],
+                                               'home_id': [team_id], 'away_id': [team_id]}))
+        weighted_possession, weighted_passes = self._weighted[(match_id, team_id)]
+
+        team_stats_vector = {
+            't_avg_possession': _sum(history) / len(history) if len(history) else np.nan,
+            't_posw_possession': weighted_possession if len(history) else np.nan,
+        }
+
+        last_5_match_ids = set(self.team_match_ids[rows][-5:])
+        last_5_since = self.teams.days[rows][-5:][0] if len(history) else None
+
+        return team_stats_vector, weighted_passes, (last_5_match_ids, last_5_since)
+
+    def _player_stats(self,
+                      player_id,
+                      match_id,
+                      date,
+                      weighted_passes,
+                      last_5):
+        rows = self.players.before(player_id, date)
+        last_5_match_ids, last_5_since = last_5
+
+        # running aggregates of the player's row for this match, scanning the history is only needed for rows
+        # whose match date isn't the calendar's localDate and for players not in the squad
+        i = self.rolling.row(player_id, match_id, date)
+        if i is not None:
+            last_5_minutes = self.rolling.last_minutes(i, last_5_match_ids, last_5_since)
+            if last_5_minutes is None:
+                last_5_minutes = self._last_5_minutes(rows, last_5_match_ids)
+            return self.rolling.stats(i, weighted_passes.get(player_id, np.nan), last_5_minutes)
+
+        passes = self.player_passes[rows]
+        last_5_minutes = self._last_5_minutes(rows, last_5_match_ids)
+
+        if len(passes) == 0:
+            avg_passAtt = np.nan
+            std_passAtt = np.nan
+            avg_minsPlayed = np.nan
+            weighted_passAtt = np.nan
+        else:
+            minutes = self.player_minutes[rows]
+            avg_passAtt = _sum(passes) / len(passes)
+            std_passAtt = _std(passes)
+            avg_minsPlayed = _sum(minutes) / len(minutes)
+            weighted_passAtt = weighted_passes.get(player_id, np.nan)
+
+        return {
+            'p_avg_passes': avg_passAtt,
+            'p_std_passes': std_passAtt,
+            'p_avg_minsPlayed': avg_minsPlayed,
+            'p_weighted_passes': weighted_passAtt,
+            'p_last5_minsPlayed': _sum(last_5_minutes) / len(last_5_minutes) if len(last_5_minutes) else 0
+        }
+
+    def _last_5_minutes(self,
+                        rows: slice,
+                        last_5_match_ids: set) -> np.ndarray:
+        # last 5 matches of the team, whoever the player featured for
+        return self.player_minutes[rows][[x in last_5_match_ids for x in self.player_match_ids[rows]]]
+
+    def match_vectors(self,
+                      match,
+                      training: bool = True) -> list:
+        final_feat_list = []
+
+        team_ids = {'home': match.home_id,
+                    'away': match.away_id}
+
+        for team in ['home', 'away']:
+            team_id = team_ids[team]
+
+            team_stats_vector, weighted_passes, last_5 = self._team_history(team_id, match.id, match.localDate)
+            squad_ids = self.roster.team_player_ids(team_id, match.localDate)
+
+            team_squad = self.match_players.get((match.id, team_id))
+            if team_squad is None:
+                continue
+
+            for player in team_squad.itertuples(index=False):
+
+                final_dict = {
+                    'player_id': player.playerId,
+                    'player_name': player.matchName,
+                    'player_position': player.position,
+                    'team_id': team_id,
+                    'match_id': match.id,
+                    'match_date': match.localDate,
+                    'match_week': match.week,
+                    'is_home': True if team == 'home' else False
+                }
+
+                # history only counts for players in the team's squad on the match date
+                if player.playerId in squad_ids:
+                    player_vector = self._player_stats(player.playerId, match.id, match.localDate,
+                                                       weighted_passes, last_5)
+                else:
+                    player_vector = self._player_stats(None, match.id, match.localDate, {}, (set(), None))
+
+                final_dict.update(player_vector)
+                final_dict.update(team_stats_vector)
+
+                if training == True:
+                    final_dict['is_sub'] = player.isSub
+                    final_dict['target'] = player.totalPass
+
+                final_feat_list.append(final_dict)
+
+        return final_feat_list
+
+    def build(self,
+              calendar: pd.DataFrame,
+              training: bool = True) -> pd.DataFrame:
+        list_of_all_vectors = []
+        self._weight_matches(calendar)
+
+        for match in calendar.itertuples(index=False):
+            list_of_all_vectors.extend(self.match_vectors(match, training=training))
+
+        return pd.DataFrame(list_of_all_vectors)
+
+
+# matches a build_features worker has to get through before a process pays for itself, below that the calendar is
+# built in process
+MIN_MATCHES_PER_WORKER = 200
+
+# state of a build_features worker process: the memory mapped Arrow tables, opened once per process
+_worker_tables = None
+
+
+def _init_worker(paths: dict):
+    import pyarrow.feather as feather
+
+    global _worker_tables
+    # uncompressed files, so the mapped pages are shared between the workers instead of decompressed per process
+    _worker_tables = {name: feather.read_table(path, memory_map=True) for name, path in paths.items()}
+
+
+def _build_chunk(chunk: pd.DataFrame,
+                 rows: dict,
+                 training: bool,
+                 bandwidth) -> list:
+    # (calendar position, vectors) of every match of the chunk, from an engine over only the rows it needs
+    team_data, player_data, squad_data = [_worker_tables[name].take(rows[name]).to_pandas()
+                                          for name in ['team_data', 'player_data', 'squad_data']]
+    engine = FeatureEngine(team_data, player_data, squad_data, bandwidth=bandwidth)
+    engine._weight_matches(chunk)
+    return [(position, engine.match_vectors(match, training=training))
+            for position, match in zip(chunk['_position'], chunk.itertuples(index=False))]
+
+
+def _chunk_rows(chunk: pd.DataFrame,
+                team_data: pd.DataFrame,
+                player_data: pd.DataFrame,
+                squad_data: pd.DataFrame,
+                team_days: np.ndarray,
+                player_days: np.ndarray) -> dict:
+    # positions of the rows the features of the chunk's matches depend on: the chunk teams' matches and squads,
+    # and every row of the players featuring in its matches, whichever team they played for. nothing dated after
+    # the chunk's last day (+1 for match dates in UTC) can be in a pre-match history
+    team_ids = set(chunk.home_id) | set(chunk.away_id)
+    match_ids = set(chunk.id)
+    last_day = _to_days(chunk.localDate).max() + np.timedelta64(1, 'D')
+
+    team_rows = (team_data.team_id.isin(team_ids).to_numpy() & (team_days <= last_day)) \
+        | team_data.match_id.isin(match_ids).to_numpy()
+    player_ids = set(player_data.playerId[player_data.match_id.isin(match_ids)])
+    player_rows = ((player_data.team_id.isin(team_ids) | player_data.playerId.isin(player_ids)).to_numpy()
+                   & (player_days <= last_day)) | player_data.match_id.isin(match_ids).to_numpy()
+    squad_rows = squad_data.contestantId.astype(str).isin({str(team_id) for team_id in team_ids}).to_numpy()
+
+    return {'team_data': np.flatnonzero(team_rows),
+            'player_data': np.flatnonzero(player_rows),
+            'squad_data': np.flatnonzero(squad_rows)}
+
+
+def _chunks(calendar: pd.DataFrame,
+            n_chunks: int,
+            shard_by: str) -> list:
+    # contiguous, date ordered chunks of about equal numbers of matches, cut only where `shard_by` changes
+    calendar = calendar.iloc[np.argsort(_to_days(calendar.localDate), kind='stable')]
+    keys = calendar[shard_by].to_numpy()
+    boundaries = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+
+    cuts = np.unique(boundaries[np.searchsorted(boundaries, np.linspace(0, len(calendar), n_chunks + 1)[1:-1])
+                     .clip(max=len(boundaries) - 1)])
+    bounds = np.r_[0, cuts, len(calendar)]
+    return [calendar.iloc[start:end] for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+
+
+# builds the features of a calendar on a pool of processes. the calendar is cut into one date ordered chunk per
+# worker (never splitting a `shard_by` group, matchweek by default) and each chunk's engine is built from only the
+# history rows its matches depend on. the histories are written once as uncompressed Arrow files every worker memory
+# maps, chunks pick their rows out of them, and the rows come back in calendar order whatever order chunks finish in.
+# calendars with fewer than MIN_MATCHES_PER_WORKER matches per worker, or max_workers=1, are built in process.
+# a callable bandwidth has to be picklable (a module level function)
+def build_features(team_data: pd.DataFrame,
+                   player_data: pd.DataFrame,
+                   squads,
+                   calendar: pd.DataFrame,
+                   training: bool = True,
+                   max_workers: int = None,
+                   shard_by: str = 'week',
+                   bandwidth='std') -> pd.DataFrame:
+    n_workers = min(max_workers or os.cpu_count() or 1, calendar.shape[0] // MIN_MATCHES_PER_WORKER)
+    if n_workers <= 1:
+        return FeatureEngine(team_data, player_data, squads, bandwidth=bandwidth).build(calendar, training=training)
+
+    squads = (squads if isinstance(squads, RosterIndex) else RosterIndex(squads)).squad_data
+    team_data, player_data, squads = [data.reset_index(drop=True) for data in [team_data, player_data, squads]]
+    team_days, player_days = _to_days(team_data.match_date), _to_days(player_data.match_date)
+
+    calendar = calendar.assign(_position=np.arange(calendar.shape[0]))
+    chunks = _chunks(calendar, n_workers, shard_by)
+    rows = [_chunk_rows(chunk, team_data, player_data, squads, team_days, player_days) for chunk in chunks]
+
+    with tempfile.TemporaryDirectory() as shared_dir:
+        paths = {}
+        for name, data in [('team_data', team_data), ('player_data', player_data), ('squad_data', squads)]:
+            paths[name] = os.path.join(shared_dir, f'{name}.arrow')
+            data.to_feather(paths[name], compression='uncompressed')
+
+        with ProcessPoolExecutor(max_workers=n_workers,
+                                 initializer=_init_worker,
+                                 initargs=(paths,)) as executor:
+            results = [vectors for chunk_vectors in executor.map(_build_chunk, chunks, rows,
+                                                                 [training] * len(chunks),
+                                                                 [bandwidth] * len(chunks))
+                       for vectors in chunk_vectors]
+
+    list_of_all_vectors = []
+    for _, vectors in sorted(results, key=lambda result: result[0]):
+        list_of_all_vectors.extend(vectors)
+
+    return pd.DataFrame(list_of_all_vectors)
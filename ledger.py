@@ -0,0 +1,90 @@
+import hashlib
+import json
+import sqlite3
+from datetime import datetime, timezone
+
+import pandas as pd
+
+
+class IngestionLedger:
+    # local sqlite record of which matches have been ingested into the match data tables, with the
+    # MA1 lastUpdated and a hash of the MA2 payload they were built from. lets a backfill fetch only
+    # matches that are new or were updated by StatsPerform since they were loaded.
+    # rows are keyed by storage target (a storage's `location`), so backfills into different storages
+    # sharing one ledger file each track their own matches
+    def __init__(self,
+                 path: str = 'ingestion_ledger.sqlite',
+                 target: str = ''):
+        self.path = path
+        self.target = target
+        self.connection = sqlite3.connect(path)
+
+        # ledgers from before targets were tracked can't tell which storage their rows were written to,
+        # they're set aside and every target is seeded again from its own tables
+        columns = [row[1] for row in self.connection.execute("pragma table_info(ingested_matches)")]
+        if columns and 'storage_target' not in columns:
+            self.connection.execute("alter table ingested_matches rename to ingested_matches_untargeted")
+
+        self.connection.execute("""
+            create table if not exists ingested_matches (
+                storage_target text,
+                match_id text,
+                tourney_cal_id text,
+                last_updated text,
+                payload_hash text,
+                ingested_at text,
+                primary key (storage_target, match_id)
+            )
+        """)
+        self.connection.commit()
+
+    @staticmethod
+    def payload_hash(payload) -> str:
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def is_empty(self) -> bool:
+        return self.connection.execute("select count(*) from ingested_matches where storage_target = ?",
+                                       (self.target,)).fetchone()[0] == 0
+
+    def ingested_matches(self) -> pd.DataFrame:
+        return pd.read_sql_query("select * from ingested_matches where storage_target = ?", self.connection,
+                                 params=(self.target,))
+
+    def payload_hashes(self) -> dict:
+        return dict(self.connection.execute("select match_id, payload_hash from ingested_matches "
+                                            "where storage_target = ?", (self.target,)))
+
+    # splits the calendar (MA1 matchInfo rows with id and lastUpdated) into matches never ingested
+    # and matches ingested from an older lastUpdated. both lists keep calendar order
+    def pending_matches(self,
+                        calendar: pd.DataFrame):
+        ingested = dict(self.connection.execute("select match_id, last_updated from ingested_matches "
+                                                "where storage_target = ?", (self.target,)))
+
+        new_ids, updated_ids = [], []
+        for match_id, last_updated in zip(calendar['id'], calendar['lastUpdated']):
+            if match_id not in ingested:
+                new_ids.append(match_id)
+            elif ingested[match_id] != last_updated:
+                updated_ids.append(match_id)
+
+        return new_ids, updated_ids
+
+    def record(self,
+               rows):
+        # rows: iterable of (match_id, tourney_cal_id, last_updated, payload_hash)
+        ingested_at = datetime.now(timezone.utc).isoformat()
+        self.connection.executemany("""
+            insert into ingested_matches (storage_target, match_id, tourney_cal_id, last_updated, payload_hash,
+                                          ingested_at)
+            values (?, ?, ?, ?, ?, ?)
+            on conflict(storage_target, match_id) do update set
+                tourney_cal_id = excluded.tourney_cal_id,
+                last_updated = excluded.last_updated,
+                payload_hash = coalesce(excluded.payload_hash, ingested_matches.payload_hash),
+                ingested_at = excluded.ingested_at
+        """, [(self.target, *row, ingested_at) for row in rows])
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
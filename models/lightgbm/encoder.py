@@ -0,0 +1,97 @@
+"""Ordinal label encoding for LGBMOrdinal """
+
+import numpy as np
+
+
+class OrdinalLabelEncoder:
+    """Maps raw ordinal targets (e.g. pass counts) to dense classes 0..K-1
+
+    Every observed value starts as its own class. Values seen fewer than
+    min_count times are merged into their neighbours, and adjacent classes with
+    the smallest combined count are merged until there are at most max_classes,
+    which coarsens the sparse tails first while dense ranges keep one class per
+    value. Values between or outside the observed ones fall into the class of
+    the nearest observed value below (the first class below the lowest one).
+
+    Parameters
+    ----------
+    max_classes : int, optional
+        upper bound on the number of classes, no bound when None
+    min_count : int, default 1
+        minimum number of training rows per class
+
+    Attributes
+    ----------
+    lower_ : np.ndarray
+        lowest observed value of each class
+    upper_ : np.ndarray
+        highest observed value of each class
+    values_ : np.ndarray
+        count weighted mean of the observed values of each class, used by
+        expected_value
+    modes_ : np.ndarray
+        most frequent observed value of each class (the lowest one on ties), in
+        the dtype of the fitted labels, the value inverse_transform maps a class
+        back to
+    counts_ : np.ndarray
+        training rows per class
+    """
+
+    def __init__(self, max_classes: int = None, min_count: int = 1):
+        assert max_classes is None or max_classes >= 2, "max_classes must be at least 2"
+        self.max_classes = max_classes
+        self.min_count = min_count
+
+    @property
+    def n_classes(self) -> int:
+        return len(self.lower_)
+
+    def fit(self, y) -> "OrdinalLabelEncoder":
+        y = np.asarray(y)
+        values, counts = np.unique(y.astype(float), return_counts=True)
+        # classes as [first value index, last value index, count]
+        classes = []
+        for i, count in enumerate(counts):
+            if classes and classes[-1][2] < self.min_count:
+                classes[-1][1], classes[-1][2] = i, classes[-1][2] + count
+            else:
+                classes.append([i, i, count])
+        # a rare last class goes into the one below
+        if len(classes) > 1 and classes[-1][2] < self.min_count:
+            last = classes.pop()
+            classes[-1][1], classes[-1][2] = last[1], classes[-1][2] + last[2]
+
+        while self.max_classes is not None and len(classes) > self.max_classes:
+            pair_counts = [classes[i][2] + classes[i + 1][2] for i in range(len(classes) - 1)]
+            i = int(np.argmin(pair_counts))
+            classes[i] = [classes[i][0], classes[i + 1][1], pair_counts[i]]
+            del classes[i + 1]
+
+        first = np.array([c[0] for c in classes])
+        last = np.array([c[1] for c in classes])
+        self.lower_ = values[first]
+        self.upper_ = values[last]
+        self.counts_ = np.array([c[2] for c in classes])
+        weighted = np.cumsum(np.append(0, values * counts))
+        self.values_ = (weighted[last + 1] - weighted[first]) / self.counts_
+        modes = [values[f + np.argmax(counts[f:l + 1])] for f, l in zip(first, last)]
+        self.modes_ = np.array(modes).astype(y.dtype)
+        return self
+
+    def transform(self, y) -> np.ndarray:
+        """Raw values to classes 0..n_classes - 1"""
+        classes = np.searchsorted(self.lower_, np.asarray(y, dtype=float), side="right") - 1
+        return np.clip(classes, 0, self.n_classes - 1)
+
+    def fit_transform(self, y) -> np.ndarray:
+        return self.fit(y).transform(y)
+
+    def inverse_transform(self, classes) -> np.ndarray:
+        """Classes back to the most frequent raw value of each class, with the
+        dtype of the fitted labels
+        """
+        return self.modes_[np.asarray(classes).astype(int)]
+
+    def expected_value(self, probas: np.ndarray) -> np.ndarray:
+        """Expected raw value of class probabilities (rows x n_classes)"""
+        return np.asarray(probas) @ self.values_
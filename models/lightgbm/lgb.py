@@ -1,13 +1,17 @@
 """Ordinal classifier lightgbm implementation """
 
+import time
+
 import numpy as np
 from lightgbm import LGBMRegressor
 from scipy.optimize import minimize
 
+from encoder import OrdinalLabelEncoder
 from loss import (
+    FusedOrdinalLoss,
     alpha2theta,
-    lgb_ordinal_loss,
-    ordinal_logistic_nll,
+    alpha_gradient,
+    ordinal_logistic_nll_theta_gradient,
     probas_from_y_pred,
     theta2alpha,
 )
@@ -64,48 +68,89 @@ class LGBMOrdinal(LGBMRegressor):
         )
         # self.threshold_interval = threshold_interval
 
-    def _initialise_theta(self):
-        return np.linspace(0, (self.n_classes - 2) * 1, self.n_classes - 1)
+    def _initialise_theta(self, y=None):
+        if y is None:
+            return np.linspace(0, (self.n_classes - 2) * 1, self.n_classes - 1)
+        # logits of the cumulative class frequencies, the thresholds minimising
+        # the loss at the zero raw scores boosting starts from
+        counts = np.bincount(np.asarray(y).astype(int), minlength=self.n_classes)
+        cumulative = np.cumsum(counts)[:-1] / counts.sum()
+        return np.log(cumulative) - np.log1p(-cumulative)
 
-    def _lgb_loss_factory(self):
-        self.theta = self._initialise_theta()
+    def _lgb_loss_factory(self, y=None, threshold_update_interval=None):
+        self.theta = self._initialise_theta(y)
+        # buffers of the fused gradient / hessian are reused across boosting iterations
+        fused_loss = FusedOrdinalLoss()
+        iteration = 0
 
         def loss(y_test, y_pred):
-            return lgb_ordinal_loss(y_test, y_pred, self.theta)
+            # y_pred are the raw scores of the current booster on the training
+            # rows, thresholds are re-optimised against them every
+            # threshold_update_interval rounds (starting with round 0, where they
+            # fit the class frequencies) and boosting continues from the same trees
+            nonlocal iteration
+            if threshold_update_interval and iteration % threshold_update_interval == 0:
+                self._optimise_alpha(y_test, y_pred, iteration=iteration)
+            iteration += 1
+            return fused_loss(y_test, y_pred, self.theta)
 
         return loss
 
     @staticmethod
     def _alpha_loss_factory(y_true, y_preds):
         """
-        Creates loss parametrised by alpha
+        Creates loss parametrised by alpha, returning the loss and its
+        analytic gradient with respect to alpha
         """
 
         def loss(alpha):
             theta = alpha2theta(alpha)
-            return ordinal_logistic_nll(y_true=y_true, y_preds=y_preds, theta=theta)
+            nll, theta_gradient = ordinal_logistic_nll_theta_gradient(
+                y_true=y_true, y_preds=y_preds, theta=theta
+            )
+            return nll, alpha_gradient(alpha, theta_gradient)
 
         return loss
 
-    def _optimise_alpha(self, y_true, y_preds):
+    def _optimise_alpha(self, y_true, y_preds, iteration=None):
         """
-        Takes loss parametrised by alpha and optimises it.
-        Can optionally take in gradient.
+        Takes loss parametrised by alpha and optimises it with its gradient.
+        Convergence diagnostics of every optimisation are appended to
+        alpha_diagnostics_.
         """
         loss = self._alpha_loss_factory(y_true, y_preds)
         alpha = theta2alpha(self.theta)
         bounds = [(None, 3.58)] * len(alpha)
-        self._alpha_optimisation_report = minimize(loss, alpha, bounds=bounds)
-        alpha = self._alpha_optimisation_report.x
+        initial_loss = loss(alpha)[0]
+
+        start = time.perf_counter()
+        self._alpha_optimisation_report = minimize(loss, alpha, jac=True, bounds=bounds)
+        report = self._alpha_optimisation_report
+        alpha = report.x
         self.theta = alpha2theta(alpha)
 
-    def _initialise_objective(self, y):
+        self.alpha_diagnostics_.append(
+            {
+                "iteration": iteration,
+                "success": report.success,
+                "message": str(report.message),
+                "n_iterations": report.nit,
+                "n_evaluations": report.nfev,
+                "initial_loss": initial_loss,
+                "loss": report.fun,
+                "max_abs_gradient": np.max(np.abs(report.jac)),
+                "seconds": time.perf_counter() - start,
+            }
+        )
+
+    def _initialise_objective(self, y, threshold_update_interval=None):
         """
         initialises the objective by creating the loss and setting the class
         attributes
         """
         self.n_classes = len(np.unique(y))
-        self.objective = self._lgb_loss_factory()
+        self.alpha_diagnostics_ = []
+        self.objective = self._lgb_loss_factory(y, threshold_update_interval)
         self._objective = self.objective
 
     def _output_to_probability(self, output):
@@ -131,6 +176,9 @@ class LGBMOrdinal(LGBMRegressor):
         X,
         y,
         hot_start_iterations=5,
+        threshold_update_interval=None,
+        max_classes=None,
+        min_class_count=1,
         sample_weight=None,
         init_score=None,
         eval_set=None,
@@ -145,9 +193,25 @@ class LGBMOrdinal(LGBMRegressor):
         callbacks=None,
         init_model=None,
     ) -> "LGBMOrdinal":
-        """Docstring is inherited from the LGBMModel."""
-        self._initialise_objective(y)
-        self._hot_start(X, y, hot_start_iterations=hot_start_iterations)
+        """Docstring is inherited from the LGBMModel.
+
+        With threshold_update_interval set, the thresholds are re-optimised every
+        threshold_update_interval boosting rounds of a single training run
+        instead of once after a discarded hot start of hot_start_iterations.
+
+        y holds raw ordinal values (e.g. pass counts, gaps allowed), mapped to
+        classes 0..K-1 by label_encoder_. max_classes bounds K and classes with
+        fewer than min_class_count rows are merged with their neighbours, see
+        OrdinalLabelEncoder. predict returns raw values in the dtype of y.
+        """
+        self.label_encoder_ = OrdinalLabelEncoder(max_classes=max_classes, min_count=min_class_count)
+        y = self.label_encoder_.fit_transform(y)
+        if eval_set is not None:
+            eval_set = [(X_eval, self.label_encoder_.transform(y_eval)) for X_eval, y_eval in eval_set]
+
+        self._initialise_objective(y, threshold_update_interval)
+        if not threshold_update_interval:
+            self._hot_start(X, y, hot_start_iterations=hot_start_iterations)
         self._fit(
             X,
             y,
@@ -223,7 +287,8 @@ class LGBMOrdinal(LGBMRegressor):
             pred_contrib=pred_contrib,
             **kwargs,
         )
-        return np.argmax(preds, axis=1)
+        # most frequent raw value of the most likely class, same dtype as the labels passed to fit
+        return self.label_encoder_.inverse_transform(np.argmax(preds, axis=1))
 
     def predict_proba(
         self,
@@ -1,111 +1,5 @@
-from functools import wraps
-
 import numpy as np
-
-
-def dec_clip_y_pred(fun):
-    @wraps(fun)
-    def wrapped(*, y_true, y_preds, theta):
-        y_preds = np.clip(y_preds, max(theta) - 36, a_max=700 + min(theta))
-        return fun(y_true=y_true, y_preds=y_preds, theta=theta)
-
-    return wrapped
-
-
-def stack_zeros_ones(a: np.ndarray, only_zeros=False) -> np.ndarray:
-    """Stacks zeroes and ones on the left and rights part of the array
-    Stacks horizontally zeros and ones on the left and right hand side of the array
-    respectively. If only_zeros is true then it only stacks zeros. This is for the
-    gradient which is zero at both ends of the sigmoid.
-    e.g.::
-
-        a = [[1,2],
-            [3,4],
-            [5,6]]
-        returns
-            [[0,1,2,1],
-            [0,3,4,1],
-            [0,5,6,1]]
-
-
-    Parameters
-    ----------
-    a: np.ndarray
-        A 2D array to pad with zeroes and ones
-    only_zeros: bool, default False
-        If true, then it pads with only zeroes
-
-    Returns
-    -------
-    np.ndarray
-
-    """
-    if only_zeros:
-        return np.hstack(
-            (
-                np.zeros(a.shape[0])[:, np.newaxis],
-                a,
-                np.zeros(a.shape[0])[:, np.newaxis],
-            )
-        )
-
-    return np.hstack(
-        (np.zeros(a.shape[0])[:, np.newaxis], a, np.ones(a.shape[0])[:, np.newaxis])
-    )
-
-
-def sigmoid(z) -> np.ndarray:
-    """Sigmoid
-    Sigmoid implementation in numpy
-
-    Parameters
-    ----------
-    z : np.ndarray
-
-    Returns
-    -------
-    np.ndarray
-        Sigmoid
-    """
-    return 1 / (1 + np.exp(-z))
-
-
-def grad_sigmoid(z) -> np.ndarray:
-    """Gradient
-    Gradient of the sigmoid
-
-    Parameters
-    ----------
-    z : np.ndarray
-
-    Returns
-    -------
-    np.ndarray
-        Gradient of Sigmoid
-
-    """
-    phat = sigmoid(z)
-    return phat * (1 - phat)
-
-
-def hess_sigmoid(z) -> np.ndarray:
-    """Hessian
-    Hessian of the sigmoid
-    Sigmoid implementation in numpy
-
-    Parameters
-    ----------
-    z : np.ndarray
-
-    Returns
-    -------
-    np.ndarray
-        Hessian of sigmoid
-
-    """
-    grad = grad_sigmoid(z)
-    sig = sigmoid(z)
-    return grad * (1 - sig) - sig * (grad)
+from scipy.special import expit, log_expit
 
 
 # class y2ord():# Convert ordinal to 1, 2, ... K
@@ -139,25 +33,65 @@ def theta2alpha(theta):  # alpha[t] = log(theta[t] - theta[t-1])
 #     return(alpha, theta, beta, K)
 
 
+def log1mexp(d) -> np.ndarray:
+    """log(1 - exp(-d))
+    Computed with expm1 for small d and log1p for large d, accurate for all
+    d > 0 and 0 at d = inf.
+
+    Parameters
+    ----------
+    d : np.ndarray
+
+    Returns
+    -------
+    np.ndarray
+    """
+    d = np.asarray(d, dtype=float)
+    with np.errstate(divide="ignore"):
+        return np.where(d < np.log(2), np.log(-np.expm1(-d)), np.log1p(-np.exp(-d)))
+
+
+def pad_theta(theta: np.ndarray) -> np.ndarray:
+    """Thresholds with -inf and inf on either side, so that class k lies
+    between padded[k] and padded[k + 1] for every class including the first
+    and last one
+    """
+    return np.concatenate(([-np.inf], np.asarray(theta, dtype=float), [np.inf]))
+
+
+def _label_margins(y_true: np.ndarray, y_preds: np.ndarray, theta: np.ndarray):
+    """Upper and lower margins of the label class
+    u = theta[y] - y_pred and l = theta[y - 1] - y_pred, inf / -inf where the
+    label is the last / first class
+    """
+    padded = pad_theta(theta)
+    y_true = np.asarray(y_true).astype(int)
+    return padded[y_true + 1] - y_preds, padded[y_true] - y_preds
+
+
+def log_probas_from_y_pred(y_preds, theta):
+    """
+    converts y_preds to log probabilities
+
+    With u and l the margins of the upper and lower thresholds of a class,
+    P = sigmoid(u) - sigmoid(l) = sigmoid(u) * sigmoid(-l) * (1 - exp(-(u - l))) so
+    log P = log_sigmoid(u) + log_sigmoid(-l) + log1mexp(u - l), which stays
+    accurate when adjacent thresholds are close or the prediction is far from
+    them, where the difference of sigmoids underflows.
+    """
+    padded = pad_theta(theta)
+    upper = padded[np.newaxis, 1:] - y_preds[:, np.newaxis]
+    lower = padded[np.newaxis, :-1] - y_preds[:, np.newaxis]
+    return log_expit(upper) + log_expit(-lower) + log1mexp(padded[1:] - padded[:-1])[np.newaxis, :]
+
+
 def probas_from_y_pred(y_preds, theta):
     """
     convers y_preds to probabilities
     """
-    s_array: np.ndarray = sigmoid(theta - y_preds[:, np.newaxis])
-    # Adding boundary terms of 1 and 0 to make sure that we have probabilities for
-    # all classes :TODO: Explain in detail
-    # Cumulative probabilities, for column k and row i this matrix represents
-    # P(y_i<=k)
-    c_probas = stack_zeros_ones(s_array)
+    return np.exp(log_probas_from_y_pred(y_preds, theta))
 
-    probas = c_probas[:, 1 : len(theta) + 2] - c_probas[:, 0 : len(theta) + 1]
-    # probas = np.clip(
-    #     probas, a_min=np.finfo(float).eps, a_max=1 - len(theta) * np.finfo(float).eps
-    # )
-    return probas
 
-
-@dec_clip_y_pred
 def ordinal_logistic_nll(y_true: np.ndarray, y_preds: np.ndarray, theta: np.ndarray):
     """Ordinal Negative log lilelihood
 
@@ -178,16 +112,61 @@ def ordinal_logistic_nll(y_true: np.ndarray, y_preds: np.ndarray, theta: np.ndar
         logistic ordinal negative log likelihood
 
     """
-    probas = probas_from_y_pred(y_preds, theta)
-    # probabilities associated with the correct label
-    label_probas = probas[np.arange(0, len(y_true)), y_true]
-    label_probas = np.clip(
-        label_probas,
-        a_min=np.finfo(float).eps,
-        a_max=1 - len(theta) * np.finfo(float).eps,
-    )
+    upper, lower = _label_margins(y_true, y_preds, theta)
+    # log probabilities of the correct label, see log_probas_from_y_pred
+    label_log_probas = log_expit(upper) + log_expit(-lower) + log1mexp(upper - lower)
     # loss
-    return -np.sum(np.log(label_probas))
+    return -np.sum(label_log_probas)
+
+
+def ordinal_logistic_nll_theta_gradient(
+    y_true: np.ndarray, y_preds: np.ndarray, theta: np.ndarray
+):
+    """Ordinal nll and its gradient with respect to the thresholds
+    Each row only depends on the thresholds bracketing its label. With
+    d = u - l, the row's derivatives are -(sigmoid(-u) + 1 / expm1(d)) for the
+    upper threshold and sigmoid(l) + 1 / expm1(d) for the lower one, summed per
+    threshold with bincount
+
+    Parameters
+    ----------
+    y_true : np.ndarray
+        1-D array with correct labels, starts from 0 and goes up to the number
+        of unique classes minus one
+    y_preds : np.ndarray
+        1-D array with predictions in latent space
+    theta : np.ndarray
+        thresholds, 1-D array, size is the number of classes minus one.
+
+    Returns
+    -------
+    (float, np.ndarray)
+        logistic ordinal negative log likelihood and its gradient with respect
+        to theta
+
+    """
+    y_true = np.asarray(y_true).astype(int)
+    upper, lower = _label_margins(y_true, y_preds, theta)
+    gap = upper - lower
+    nll = -np.sum(log_expit(upper) + log_expit(-lower) + log1mexp(gap))
+
+    with np.errstate(divide="ignore"):
+        gap_term = 1 / np.expm1(gap)
+    # positions in the padded thresholds, the -inf / inf pads (0 and K) are dropped
+    n_padded = len(theta) + 2
+    gradient = np.bincount(y_true + 1, weights=-(expit(-upper) + gap_term), minlength=n_padded)
+    gradient += np.bincount(y_true, weights=expit(lower) + gap_term, minlength=n_padded)
+    return nll, gradient[1:-1]
+
+
+def alpha_gradient(alpha: np.ndarray, theta_gradient: np.ndarray) -> np.ndarray:
+    """Chain rule through alpha2theta
+    theta[t] = alpha[0] + sum(exp(alpha[1:t + 1])), so the gradient with respect
+    to alpha[j] is the sum of the theta gradients from t = j on, times exp(alpha[j])
+    for j >= 1
+    """
+    tail_sums = np.cumsum(theta_gradient[::-1])[::-1]
+    return tail_sums * np.append(1.0, np.exp(alpha[1:]))
 
 
 # Gradient
@@ -195,7 +174,10 @@ def gradient_ordinal_logistic_nll(
     y_true: np.ndarray, y_preds: np.ndarray, theta: np.ndarray
 ) -> np.ndarray:
     """Gradient of ordinal nll
-    Gradient of the ordinal logistic regression with respect to the predictions
+    Gradient of the ordinal logistic regression with respect to the predictions.
+    Differentiating log P = log_sigmoid(u) + log_sigmoid(-l) + log1mexp(u - l),
+    u and l both move by -1 with the prediction so the log1mexp term drops out
+    and the gradient of the nll is sigmoid(-u) - sigmoid(l)
 
     Parameters
     ----------
@@ -214,21 +196,17 @@ def gradient_ordinal_logistic_nll(
         Gradient of logistic ordinal negative log likelihood
 
     """
-    y_preds = np.clip(y_preds, -20, a_max=700 + min(theta))
-    probas = probas_from_y_pred(y_preds, theta)
-    y_true = y_true.astype(int)
-    gs_array: np.ndarray = grad_sigmoid(theta - y_preds[:, np.newaxis])
-    gc_probas = stack_zeros_ones(gs_array, only_zeros=True)
-    g_probas = -(gc_probas[:, 1 : len(theta) + 2] - gc_probas[:, 0 : len(theta) + 1])
-    gradient = -(g_probas / probas)[np.arange(0, len(y_true)), y_true]
-    return gradient
+    upper, lower = _label_margins(y_true, y_preds, theta)
+    return expit(-upper) - expit(lower)
 
 
 def hessian_ordinal_logistic_nll(
     y_true: np.ndarray, y_preds: np.ndarray, theta: np.ndarray
 ) -> np.ndarray:
     """Hessian of ordinal nll
-    Hessian of the ordinal logistic regression with respect to the predictions
+    Hessian of the ordinal logistic regression with respect to the predictions,
+    sigmoid(u) * sigmoid(-u) + sigmoid(l) * sigmoid(-l). Always positive, the
+    loss is convex in the prediction
 
     Parameters
     ----------
@@ -247,22 +225,109 @@ def hessian_ordinal_logistic_nll(
         Hessian of logistic ordinal negative log likelihood
 
     """
-    y_preds = np.clip(y_preds, -20, a_max=700 + min(theta))
-    probas = probas_from_y_pred(y_preds, theta)
+    upper, lower = _label_margins(y_true, y_preds, theta)
+    return expit(upper) * expit(-upper) + expit(lower) * expit(-lower)
+
 
-    y_true = y_true.astype(int)
-    gs_array: np.ndarray = grad_sigmoid(theta - y_preds[:, np.newaxis])
-    gc_probas = stack_zeros_ones(gs_array, only_zeros=True)
-    hs_array: np.ndarray = hess_sigmoid(theta - y_preds[:, np.newaxis])
-    hc_probas = stack_zeros_ones(hs_array, only_zeros=True)
-    g_probas = -(gc_probas[:, 1 : len(theta) + 2] - gc_probas[:, 0 : len(theta) + 1])
-    h_probas = hc_probas[:, 1 : len(theta) + 2] - hc_probas[:, 0 : len(theta) + 1]
+class FusedOrdinalLoss:
+    """Fused gradient and hessian of ordinal nll
+    Computes the gradient and hessian of gradient_ordinal_logistic_nll and
+    hessian_ordinal_logistic_nll in one pass over the two thresholds bracketing
+    each label, theta[y - 1] and theta[y]. Each margin m takes one exp,
+    e = exp(-|m|), giving sigmoid(|m|) = 1 / (1 + e), sigmoid(-|m|) = e / (1 + e)
+    and sigmoid(m) * sigmoid(-m) = e / (1 + e) ** 2 without overflow or clipping.
 
-    hessian = -(h_probas / probas - np.power(g_probas / probas, 2))[
-        np.arange(0, len(y_true)), y_true
-    ]
-    # hessian[np.abs(hessian) <=np.finfo(float).eps] = -np.finfo(float).eps
-    return hessian
+    Intermediate and output arrays are allocated once per number of rows and
+    reused on every call, so the returned arrays are overwritten by the next
+    call. LightGBM copies them into the booster on every iteration.
+    """
+
+    def __init__(self):
+        self._n_rows = None
+        self._y_true = None
+
+    def _allocate(self, n_rows: int):
+        self._n_rows = n_rows
+        self._margin = np.empty(n_rows)
+        self._exp = np.empty(n_rows)
+        self._positive = np.empty(n_rows, dtype=bool)
+        self._lower_sigmoid = np.empty(n_rows)
+        self.grad = np.empty(n_rows)
+        self.hess = np.empty(n_rows)
+        self._y_true = None
+
+    def _index_labels(self, y_true: np.ndarray, n_thresholds: int):
+        # threshold positions of the labels in the padded thresholds, recomputed
+        # only when the labels change
+        if (
+            self._y_true is not None
+            and self._n_thresholds == n_thresholds
+            and (self._y_true is y_true or np.array_equal(self._y_true, y_true))
+        ):
+            return
+        self._y_true = y_true
+        self._n_thresholds = n_thresholds
+        self._lower = y_true.astype(int)
+        self._upper = self._lower + 1
+
+    def _sigmoid_terms(self, padded, index, y_preds, upper, out_sigmoid, out_hess):
+        # out_sigmoid = sigmoid(-m) for the upper margin and sigmoid(m) for the
+        # lower one, out_hess += sigmoid(m) * sigmoid(-m)
+        m, e = self._margin, self._exp
+        np.take(padded, index, out=m)
+        np.subtract(m, y_preds, out=m)
+        np.greater_equal(m, 0, out=self._positive)
+        if upper:
+            np.logical_not(self._positive, out=self._positive)
+
+        np.abs(m, out=e)
+        np.negative(e, out=e)
+        np.exp(e, out=e)
+        # m is free again, sigmoid(|m|)
+        np.add(1, e, out=m)
+        np.divide(1, m, out=m)
+        # sigmoid(-|m|) where the sign picks it, sigmoid(|m|) elsewhere
+        np.multiply(e, m, out=out_sigmoid)
+        np.copyto(out_sigmoid, m, where=self._positive)
+        # sigmoid(m) * sigmoid(-m) = sigmoid(|m|) * sigmoid(-|m|)
+        np.multiply(e, m, out=e)
+        np.multiply(e, m, out=e)
+        np.add(out_hess, e, out=out_hess)
+
+    def __call__(self, y_true: np.ndarray, y_preds: np.ndarray, theta: np.ndarray):
+        """Gradient and hessian
+
+        Parameters
+        ----------
+        y_true : np.ndarray
+            1-D array with correct labels, starts from 0 and goes up to the number
+            of unique classes minus one
+        y_preds : np.ndarray
+            1-D array with predictions in latent space
+        theta : np.ndarray
+            thresholds, 1-D array, size is the number of classes minus one.
+
+        Returns
+        -------
+        (np.ndarray, np.ndarray)
+            Gradient and Hessian of logistic ordinal negative log likelihood
+        """
+        padded = pad_theta(theta)
+        if self._n_rows != len(y_preds):
+            self._allocate(len(y_preds))
+        self._index_labels(y_true, len(padded) - 2)
+
+        self.hess.fill(0)
+        # gradient = sigmoid(-u) - sigmoid(l)
+        self._sigmoid_terms(padded, self._upper, y_preds, True, self.grad, self.hess)
+        self._sigmoid_terms(padded, self._lower, y_preds, False, self._lower_sigmoid, self.hess)
+        np.subtract(self.grad, self._lower_sigmoid, out=self.grad)
+
+        return self.grad, self.hess
+
+
+# buffers shared by every lgb_ordinal_loss call
+_lgb_fused_loss = FusedOrdinalLoss()
 
 
 def lgb_ordinal_loss(y_true: np.ndarray, y_pred: np.ndarray, theta: np.ndarray):
@@ -270,6 +335,12 @@ def lgb_ordinal_loss(y_true: np.ndarray, y_pred: np.ndarray, theta: np.ndarray):
     The ordinal loss used in the lightgbm framework. Returns the
     gradient and hessian of the loss.
 
+    Calls go through one module level FusedOrdinalLoss, so buffers are only
+    reallocated when the number of rows changes and the label positions only
+    recomputed when the labels do. The returned arrays are overwritten by the
+    next call; trainings running side by side (threads, several datasets in
+    one objective) should each hold their own FusedOrdinalLoss instead.
+
     Parameters
     ----------
     y_true : np.ndarray
@@ -286,8 +357,7 @@ def lgb_ordinal_loss(y_true: np.ndarray, y_pred: np.ndarray, theta: np.ndarray):
     (np.ndarray, np.ndarray)
         Gradient and Hessian of logistic ordinal negative log likelihood
     """
-    grad = gradient_ordinal_logistic_nll(y_true, y_pred, theta)
-    hess = hessian_ordinal_logistic_nll(y_true, y_pred, theta)
+    grad, hess = _lgb_fused_loss(y_true, y_pred, theta)
     return (grad, hess)
 
 
@@ -0,0 +1,202 @@
+import re
+import unicodedata
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+
+# letters NFKD doesn't decompose into a base letter plus accent
+_TRANSLITERATIONS = str.maketrans({'ø': 'o', 'ł': 'l', 'đ': 'd', 'ß': 'ss', 'æ': 'ae', 'œ': 'oe', 'ı': 'i', 'þ': 'th'})
+
+
+def normalize_name(name: str) -> str:
+    # 'Martin Ødegaard' / 'M. Ødegaard' -> 'martin odegaard' / 'm odegaard'
+    name = unicodedata.normalize('NFKD', str(name).lower().translate(_TRANSLITERATIONS))
+    name = ''.join(char for char in name if not unicodedata.combining(char))
+    return ' '.join(re.sub(r'[^a-z0-9]+', ' ', name).split())
+
+
+def _trigrams(name: str) -> set:
+    padded = f'  {name} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _token_similarity(token: str,
+                      other: str) -> tuple:
+    # (similarity, whether it's a full token match) of a query token against a candidate token
+    if token == other:
+        return 1.0, len(token) > 1
+    # an initial against the token it starts
+    if len(token) == 1 or len(other) == 1:
+        return (0.9 if token[0] == other[0] else 0.0), False
+    # misspelt tokens, by trigram overlap
+    token_trigrams, other_trigrams = _trigrams(token), _trigrams(other)
+    return 2 * len(token_trigrams & other_trigrams) / (len(token_trigrams) + len(other_trigrams)), True
+
+
+def _token_score(query: list,
+                 candidate: list) -> float:
+    # share of the shorter name's tokens found in the other one. 'saka' vs 'bukayo saka', 'b saka' vs
+    # 'bukayo saka' and 'bukayo saka' vs 'b saka' all score 1. a full query token matching only a candidate's
+    # initial ('kepa' vs 'k tierney') gets no credit unless another full token matches too
+    if not query or not candidate:
+        return 0.0
+
+    # best full token and best initial match of every query token
+    full_matches, initial_matches = [], []
+    for token in query:
+        similarities = [_token_similarity(token, other) for other in candidate]
+        full_matches.append(max([similarity for similarity, full in similarities if full], default=0.0))
+        initial_matches.append(max([similarity for similarity, full in similarities if not full], default=0.0))
+
+    # initials count next to a matching full token, or when the query itself abbreviates a name ('k tierny')
+    any_full = max(full_matches) >= 0.5
+    credits = [max(full, initial if any_full or (len(token) == 1 and len(query) > 1) else 0.0)
+               for token, full, initial in zip(query, full_matches, initial_matches)]
+    # candidate tokens left unmatched count against the score when the candidate is the shorter name
+    credits = sorted(credits, reverse=True)[:len(candidate)]
+    return sum(credits) / min(len(query), len(candidate))
+
+
+class NameResolver:
+    # resolves player names as quoted by sportsbooks to squad player ids, per team.
+    # every name variant of a team's players is normalized and indexed by character trigrams once, a query only
+    # scores the variants sharing a trigram with it, and results are cached per (team, raw name)
+    def __init__(self,
+                 squads: dict,
+                 min_score: float = 50.0):
+        # squads: team -> {player id: name or list of name variants}, the first variant being the display name
+        self.min_score = min_score
+        self.teams = {}
+        self._cache = {}
+
+        for team, players in squads.items():
+            player_ids, display_names, variants = [], [], []
+            for player_id, names in players.items():
+                names = [names] if isinstance(names, str) else list(names)
+                for name in names:
+                    normalized = normalize_name(name)
+                    if normalized:
+                        player_ids.append(player_id)
+                        display_names.append(names[0])
+                        variants.append(normalized)
+
+            trigram_index = {}
+            for i, variant in enumerate(variants):
+                for trigram in _trigrams(variant):
+                    trigram_index.setdefault(trigram, []).append(i)
+
+            self.teams[team] = {
+                'player_ids': player_ids,
+                'display_names': display_names,
+                'tokens': [variant.split() for variant in variants],
+                'n_trigrams': np.array([len(_trigrams(variant)) for variant in variants]),
+                'trigram_index': trigram_index,
+                'exact': {variant: i for i, variant in reversed(list(enumerate(variants)))},
+            }
+
+    @classmethod
+    def from_roster(cls,
+                    roster,
+                    date=None,
+                    min_score: float = 50.0):
+        # a rosters.RosterIndex, keyed by team id and by every team name it knows (e.g. 'Man Utd')
+        squads = {}
+        for team_id in roster.team_ids:
+            squads[team_id] = {player_id: [display] + roster.name_variants(player_id)
+                               for player_id, display in roster.team_names(team_id, date).items()}
+        for team_name, team_id in roster.team_ids_by_name.items():
+            squads[team_name] = squads[team_id]
+        return cls(squads, min_score=min_score)
+
+    def _score(self,
+               team: dict,
+               name: str):
+        if name in team['exact']:
+            return team['exact'][name], 100.0
+
+        trigrams = _trigrams(name)
+        shared = Counter(i for trigram in trigrams for i in team['trigram_index'].get(trigram, []))
+        tokens = name.split()
+
+        best, best_score = None, 0.0
+        for i, n_shared in shared.items():
+            dice = 2 * n_shared / (len(trigrams) + team['n_trigrams'][i])
+            score = 100 * (0.6 * _token_score(tokens, team['tokens'][i]) + 0.4 * dice)
+            if score > best_score:
+                best, best_score = i, score
+
+        return best, best_score
+
+    def resolve(self,
+                team,
+                raw_name: str):
+        # (player id, display name, score 0-100), or (None, None, score) when nothing scores min_score
+        key = (team, raw_name)
+        if key in self._cache:
+            return self._cache[key]
+
+        if team not in self.teams or pd.isna(raw_name):
+            result = (None, None, 0.0)
+        else:
+            squad = self.teams[team]
+            i, score = self._score(squad, normalize_name(raw_name))
+            result = (squad['player_ids'][i], squad['display_names'][i], score) if i is not None \
+                and score >= self.min_score else (None, None, score)
+
+        self._cache[key] = result
+        return result
+
+    def resolve_many(self,
+                     teams,
+                     raw_names) -> pd.DataFrame:
+        # one resolution per distinct (team, name) of a slate, rows aligned with the inputs
+        pairs = pd.DataFrame({'team': list(teams), 'raw_name': list(raw_names)})
+        unique_pairs = pairs.drop_duplicates()
+
+        resolved = pd.DataFrame([self.resolve(team, raw_name) for team, raw_name in
+                                 zip(unique_pairs.team, unique_pairs.raw_name)],
+                                columns=['player_id', 'player_name', 'name_score'], index=unique_pairs.index)
+
+        return pairs.merge(pd.concat([unique_pairs, resolved], axis=1), how='left',
+                           on=['team', 'raw_name'])[['player_id', 'player_name', 'name_score']]
+
+
+class FixtureIndex:
+    # (date, team) -> fixture of the calendar, to map lines to matches with a dict lookup instead of scanning
+    # every match description per line. teams are keyed by id and by name when team_names (id -> name) is given
+    def __init__(self,
+                 calendar: pd.DataFrame,
+                 team_names: dict = None,
+                 date_col: str = 'localDate'):
+        team_names = team_names or {}
+        self.fixtures = {}
+
+        for match in calendar.itertuples(index=False):
+            date = str(getattr(match, date_col))[:10]
+            for team_id, opponent_id, is_home in [(match.home_id, match.away_id, True),
+                                                  (match.away_id, match.home_id, False)]:
+                fixture = {'match_id': match.id,
+                           'team_id': team_id,
+                           'team': team_names.get(team_id, team_id),
+                           'opponent_id': opponent_id,
+                           'opponent': team_names.get(opponent_id, opponent_id),
+                           'is_home': is_home}
+                self.fixtures[(date, team_id)] = fixture
+                if team_id in team_names:
+                    self.fixtures[(date, team_names[team_id])] = fixture
+
+    def lookup(self,
+               date,
+               team) -> dict:
+        return self.fixtures.get((str(date)[:10], team))
+
+    def lookup_many(self,
+                    dates,
+                    teams) -> pd.DataFrame:
+        # rows aligned with the inputs, NaN where the team has no fixture on that date
+        columns = ['match_id', 'team_id', 'team', 'opponent_id', 'opponent', 'is_home']
+        empty = dict.fromkeys(columns, np.nan)
+        return pd.DataFrame([self.fixtures.get((str(date)[:10], team), empty) for date, team in zip(dates, teams)],
+                            columns=columns)
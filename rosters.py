@@ -0,0 +1,162 @@
+import numpy as np
+import pandas as pd
+
+import tables
+
+
+def _days(dates: pd.Series) -> np.ndarray:
+    # squad start / end dates ('YYYY-MM-DD', sometimes with a trailing Z) as datetime64[D], NaT when open ended
+    return pd.to_datetime(dates.astype('string').str.rstrip('Z'), errors='coerce').to_numpy().astype('datetime64[D]')
+
+
+class RosterIndex:
+    # squad membership of every player over time, built once from squad_data (DataLoader.load_squads) or the
+    # squads.pickle dict. players and teams get integer codes, every membership row is (player, team, start, end)
+    # so mid-season transfers are answered by date. rows without startDate / endDate count as always members
+    def __init__(self,
+                 squads):
+        if isinstance(squads, dict):
+            squads = pd.concat([squad.assign(contestantId=team_id) for team_id, squad in squads.items()],
+                               ignore_index=True)
+        if isinstance(squads.index, pd.MultiIndex) or squads.index.name == 'contestantId':
+            squads = squads.reset_index()
+        if 'type' in squads.columns:
+            # coaches are part of the squads feed too
+            squads = squads[squads['type'].astype('string').fillna('player') == 'player']
+
+        self.squad_data = squads.reset_index(drop=True)
+
+        player_codes, self.player_ids = pd.factorize(self.squad_data['id'].astype(str))
+        team_codes, self.team_ids = pd.factorize(self.squad_data['contestantId'].astype(str))
+        self.player_codes = {player_id: code for code, player_id in enumerate(self.player_ids)}
+        self.team_codes = {team_id: code for code, team_id in enumerate(self.team_ids)}
+
+        n_rows = self.squad_data.shape[0]
+        no_date = np.full(n_rows, np.datetime64('NaT'), dtype='datetime64[D]')
+        starts = _days(self.squad_data['startDate']) if 'startDate' in self.squad_data.columns else no_date
+        ends = _days(self.squad_data['endDate']) if 'endDate' in self.squad_data.columns else no_date
+
+        # membership rows sorted by team, so a team's rows are one slice
+        order = np.argsort(team_codes, kind='stable')
+        self.member_players = player_codes[order]
+        self.member_teams = team_codes[order]
+        self.member_starts = np.where(np.isnat(starts), np.datetime64('1900-01-01'), starts)[order]
+        self.member_ends = np.where(np.isnat(ends), np.datetime64('2200-01-01'), ends)[order]
+        self.member_rows = order
+
+        bounds = np.searchsorted(self.member_teams, np.arange(len(self.team_ids) + 1))
+        self.team_slices = {team_id: slice(bounds[code], bounds[code + 1])
+                            for code, team_id in enumerate(self.team_ids)}
+
+        # team short / full names -> team id, for matching lines quoted with team names
+        self.team_ids_by_name = {}
+        for name_col in ['contestantName', 'contestantShortName', 'contestantCode']:
+            if name_col in self.squad_data.columns:
+                self.team_ids_by_name.update(zip(self.squad_data[name_col].astype(str),
+                                                 self.squad_data['contestantId'].astype(str)))
+
+        self._member_sets = {}
+        self._name_variants = None
+
+    def _members(self,
+                 team_id,
+                 date=None) -> np.ndarray:
+        # membership rows of the team, only those covering `date` when given
+        rows = self.team_slices.get(str(team_id), slice(0, 0))
+        if date is None:
+            return np.arange(rows.start, rows.stop)
+
+        day = np.datetime64(pd.Timestamp(date).date(), 'D')
+        covering = (self.member_starts[rows] <= day) & (day <= self.member_ends[rows])
+        return np.arange(rows.start, rows.stop)[covering]
+
+    def team_players(self,
+                     team_id,
+                     date=None) -> np.ndarray:
+        # integer codes of the team's players (on `date`), decode with player_ids
+        return np.unique(self.member_players[self._members(team_id, date)])
+
+    def team_player_ids(self,
+                        team_id,
+                        date=None) -> set:
+        # cached per (team, day), the feature builder asks for every match of the team
+        key = (str(team_id), None if date is None else pd.Timestamp(date).date())
+        if key not in self._member_sets:
+            self._member_sets[key] = set(self.player_ids[self.team_players(team_id, date)])
+        return self._member_sets[key]
+
+    def is_member(self,
+                  player_id,
+                  team_id,
+                  date=None) -> bool:
+        return player_id in self.team_player_ids(team_id, date)
+
+    def teams_of(self,
+                 player_id,
+                 date=None) -> list:
+        code = self.player_codes.get(str(player_id))
+        if code is None:
+            return []
+        rows = np.flatnonzero(self.member_players == code)
+        if date is not None:
+            day = np.datetime64(pd.Timestamp(date).date(), 'D')
+            rows = rows[(self.member_starts[rows] <= day) & (day <= self.member_ends[rows])]
+        return list(self.team_ids[np.unique(self.member_teams[rows])])
+
+    def player(self,
+               player_id) -> dict:
+        # name variants, latest position and squad history [(team id, start, end)] of a player
+        code = self.player_codes.get(str(player_id))
+        if code is None:
+            return None
+
+        positions = np.flatnonzero(self.member_players == code)
+        rows = self.squad_data.iloc[self.member_rows[positions]]
+        latest = rows.iloc[np.argmax(self.member_starts[positions])]
+
+        return {
+            'id': str(player_id),
+            'names': self.name_variants(player_id),
+            'position': latest.get('position'),
+            'teams': [(self.team_ids[self.member_teams[i]],
+                       None if self.member_starts[i] == np.datetime64('1900-01-01') else self.member_starts[i],
+                       None if self.member_ends[i] == np.datetime64('2200-01-01') else self.member_ends[i])
+                      for i in positions[np.argsort(self.member_starts[positions], kind='stable')]],
+        }
+
+    def name_variants(self,
+                      player_id) -> list:
+        # matchName, knownName, 'shortFirstName shortLastName' and 'firstName lastName' of every squad row of the
+        # player, built for all players in one pass on first use
+        if self._name_variants is None:
+            self._name_variants = {}
+            for row in self.squad_data.itertuples(index=False):
+                row = row._asdict()
+                candidates = [row.get(col) for col in ['matchName', 'knownName']]
+                candidates.append(' '.join(str(row[col]) for col in ['shortFirstName', 'shortLastName']
+                                           if pd.notna(row.get(col))))
+                candidates.append(' '.join(str(row[col]) for col in ['firstName', 'lastName']
+                                           if pd.notna(row.get(col))))
+                variants = self._name_variants.setdefault(str(row['id']), {})
+                variants.update(dict.fromkeys(str(name) for name in candidates if pd.notna(name) and str(name).strip()))
+
+        return list(self._name_variants.get(str(player_id), {}))
+
+    def team_names(self,
+                   team_id,
+                   date=None,
+                   name_columns: list = ('shortFirstName', 'shortLastName')) -> dict:
+        # player id -> display name of the team's players (on `date`), e.g. to fuzzy match betting lines against
+        rows = self.squad_data.iloc[self.member_rows[self._members(team_id, date)]]
+        name_columns = [col for col in name_columns if col in rows.columns] or ['matchName']
+        names = rows[name_columns].astype('string').fillna('').agg(' '.join, axis=1).str.strip()
+        return dict(zip(rows['id'].astype(str), names))
+
+    def save(self,
+             path: str = 'squads.parquet'):
+        tables.write_table(self.squad_data, path)
+
+    @classmethod
+    def load(cls,
+             path: str = 'squads.parquet'):
+        return cls(tables.read_table(path))
@@ -0,0 +1,120 @@
+import numpy as np
+import pandas as pd
+
+from config import all_player_match_stats, all_team_match_stats
+
+
+# in memory dtypes of the match tables. stats are per match counts unless listed here
+FLOAT_STATS = ['possessionPercentage']
+BOOL_STATS = ['cleanSheet', 'gameStarted']
+# formation codes (e.g. 4231) are labels, not quantities
+CATEGORICAL_STATS = ['formationUsed']
+# counts of one team / player in one match fit in int16
+COUNT_DTYPE = np.int16
+
+STAT_COLUMNS = list(dict.fromkeys(all_player_match_stats + all_team_match_stats))
+
+# id / name / label columns of the match tables, calendar, squads and feature sets. few distinct values
+# repeated on every row, dictionary encoded as pandas categoricals
+CATEGORICAL_COLUMNS = [
+    'competition_id', 'competition_name', 'tourney_cal_id', 'tourney_cal_name', 'tourneycal_id', 'tourneycal_name',
+    'match_id', 'team_id', 'team_name', 'opponent_id', 'home_id', 'away_id', 'contestantId', 'contestantName',
+    'playerId', 'matchName', 'position', 'positionSide', 'player_id', 'player_name', 'player_position', 'id',
+    'firstName', 'lastName', 'shortFirstName', 'shortLastName', 'knownName', 'type', 'nationality', 'status',
+] + CATEGORICAL_STATS
+
+# 'YYYY-MM-DDZ' match dates, parsed once to datetime64
+DATE_COLUMNS = ['match_date']
+
+
+def stat_dtype(stat: str):
+    if stat in FLOAT_STATS:
+        return np.float32
+    if stat in BOOL_STATS:
+        return bool
+    if stat in CATEGORICAL_STATS:
+        return 'category'
+    return COUNT_DTYPE
+
+
+STAT_DTYPES = {stat: stat_dtype(stat) for stat in STAT_COLUMNS}
+
+
+def _fitting(values: np.ndarray,
+             dtype) -> np.ndarray:
+    # which columns of a float block hold values representable in dtype: no missing values,
+    # 0/1 for flags, whole numbers within range for counts
+    fits = ~np.isnan(values).any(axis=0)
+    if dtype == bool:
+        return fits & np.isin(values, [0, 1]).all(axis=0)
+    return fits & (values == np.round(values)).all(axis=0) & \
+        (np.abs(np.nan_to_num(values)).max(axis=0, initial=0) <= np.iinfo(dtype).max)
+
+
+def column_dtypes(dataframe: pd.DataFrame) -> dict:
+    # stats per STAT_DTYPES, categorical ids / names / labels, float32 for any other float column (features).
+    # a stat whose values don't fit its dtype (fractional, missing, not 0/1 for flags) stays float32 rather than
+    # being truncated
+    dtypes = {}
+    to_check = {COUNT_DTYPE: [], bool: []}
+
+    for column, dtype in dataframe.dtypes.items():
+        if column in CATEGORICAL_COLUMNS:
+            dtypes[column] = 'category'
+        elif column in STAT_DTYPES and pd.api.types.is_numeric_dtype(dtype):
+            dtypes[column] = STAT_DTYPES[column]
+            if dtypes[column] in to_check and not pd.api.types.is_bool_dtype(dtype):
+                to_check[dtypes[column]].append(column)
+        elif pd.api.types.is_float_dtype(dtype):
+            dtypes[column] = np.float32
+
+    # checked as one block per dtype, the match tables have a few hundred stat columns
+    for dtype, columns in to_check.items():
+        if columns:
+            fits = _fitting(dataframe[columns].to_numpy(dtype=float), dtype)
+            for column in np.array(columns)[~fits]:
+                dtypes[column] = np.float32
+
+    return dtypes
+
+
+def compact(dataframe: pd.DataFrame) -> pd.DataFrame:
+    dtypes = column_dtypes(dataframe)
+
+    blocks, converted = [], set()
+    for dtype in set(dtype for dtype in dtypes.values() if not isinstance(dtype, str)):
+        columns = [column for column, column_dtype in dtypes.items() if column_dtype is dtype]
+        if columns:
+            blocks.append(pd.DataFrame(dataframe[columns].to_numpy().astype(dtype),
+                                       columns=columns, index=dataframe.index))
+            converted.update(columns)
+
+    for column, dtype in dtypes.items():
+        if dtype == 'category' and not isinstance(dataframe[column].dtype, pd.CategoricalDtype):
+            # through the nullable string dtype, so labels filled with 0 (e.g. positionSide) become '0'
+            # instead of mixing types within the categories, while missing values stay missing
+            blocks.append(dataframe[column].astype('string').astype('category').to_frame())
+            converted.add(column)
+
+    for column in DATE_COLUMNS:
+        if column in dataframe.columns and not pd.api.types.is_datetime64_any_dtype(dataframe[column]):
+            dates = pd.to_datetime(dataframe[column].astype(str).str.rstrip('Z'), format='%Y-%m-%d')
+            blocks.append(dates.to_frame())
+            converted.add(column)
+
+    unchanged = [column for column in dataframe.columns if column not in converted]
+    return pd.concat([dataframe[unchanged]] + blocks, axis=1)[dataframe.columns]
+
+
+def storable(dataframe: pd.DataFrame) -> pd.DataFrame:
+    # back to the schema of the stored match tables: float64 stats, string labels and 'YYYY-MM-DDZ' match dates
+    columns = {}
+    for column, dtype in dataframe.dtypes.items():
+        if column in DATE_COLUMNS and pd.api.types.is_datetime64_any_dtype(dtype):
+            columns[column] = dataframe[column].dt.strftime('%Y-%m-%dZ')
+        elif isinstance(dtype, pd.CategoricalDtype) or dtype == object:
+            columns[column] = dataframe[column].astype(str)
+        elif column in STAT_DTYPES and column not in CATEGORICAL_STATS:
+            columns[column] = dataframe[column].astype(np.float64)
+
+    return dataframe.assign(**columns)
@@ -0,0 +1,256 @@
+import glob
+import os
+import uuid
+
+import numpy as np
+import pandas as pd
+
+
+# tables every storage backend serves, under the same names
+TABLE_NAMES = ['team_match_data', 'player_match_data', 'squad_data', 'match_calendar']
+
+# operators accepted in read filters. filters follow pyarrow's disjunctive normal form: a list of
+# (column, op, value) tuples that must all hold, or a list of such lists of which any may hold
+FILTER_OPS = ['=', '!=', '<', '<=', '>', '>=', 'in', 'not in']
+
+
+def _filter_groups(filters: list) -> list:
+    if not filters:
+        return []
+    return [filters] if isinstance(filters[0], tuple) else filters
+
+
+def _table_id(table_name: str) -> str:
+    # accept both 'team_match_data' and the dataset qualified 'soccer_simulations.team_match_data'
+    return table_name.split('.')[-1]
+
+
+class BigQueryStorage:
+    # tables of the soccer_simulations BigQuery dataset
+    def __init__(self,
+                 bq_project: str = 'prizepicksanalytics',
+                 dataset: str = 'soccer_simulations',
+                 get_client=None):
+        self.bq_project = bq_project
+        self.dataset = dataset
+        self._get_client = get_client
+        self._client = None
+
+    def __str__(self):
+        return f'BigQuery dataset {self.bq_project}.{self.dataset}'
+
+    @property
+    def location(self) -> str:
+        # identifies the tables written to, e.g. for the ingestion ledger
+        return f'bigquery://{self.bq_project}.{self.dataset}'
+
+    @property
+    def client(self):
+        if self._get_client is not None:
+            return self._get_client()
+        if self._client is None:
+            from google.cloud import bigquery as bqc
+            self._client = bqc.Client(project=self.bq_project)
+        return self._client
+
+    def _full_name(self,
+                   table_name: str) -> str:
+        return f'{self.bq_project}.{self.dataset}.{_table_id(table_name)}'
+
+    @staticmethod
+    def _query_parameter(name: str,
+                         value):
+        from google.cloud import bigquery as bqc
+
+        values = list(value) if isinstance(value, (list, tuple, set, pd.Series, pd.Index)) else None
+        sample = values[0] if values else value
+        bq_type = 'BOOL' if isinstance(sample, (bool, np.bool_)) else \
+            'INT64' if isinstance(sample, (int, np.integer)) else \
+            'FLOAT64' if isinstance(sample, (float, np.floating)) else 'STRING'
+
+        if values is not None:
+            return bqc.ArrayQueryParameter(name, bq_type, values)
+        return bqc.ScalarQueryParameter(name, bq_type, value)
+
+    def query(self,
+              query: str,
+              query_parameters: list = None) -> pd.DataFrame:
+        from google.cloud import bigquery as bqc
+
+        job_config = bqc.QueryJobConfig(query_parameters=query_parameters) if query_parameters else None
+        return self.client.query(query, job_config=job_config).to_dataframe()
+
+    def read_table(self,
+                   table_name: str,
+                   columns: list = None,
+                   filters: list = None) -> pd.DataFrame:
+        # filters become query parameters, never interpolated values
+        groups, parameters = [], []
+        for group in _filter_groups(filters):
+            conditions = []
+            for column, op, value in group:
+                assert op in FILTER_OPS, f"Filter operator must be one of {FILTER_OPS}"
+                param = f'p{len(parameters)}'
+                if op in ['in', 'not in']:
+                    conditions.append(f"{'not ' if op == 'not in' else ''}{column} in unnest(@{param})")
+                else:
+                    conditions.append(f'{column} {op} @{param}')
+                parameters.append(self._query_parameter(param, value))
+            groups.append('(' + ' and '.join(conditions) + ')')
+
+        query = f"""
+            select {', '.join(columns) if columns else '*'}
+            from {self._full_name(table_name)}
+            {'where ' + ' or '.join(groups) if groups else ''}
+        """
+        return self.query(query, parameters)
+
+    def distinct_match_ids(self,
+                           table_name: str) -> set:
+        return set(self.query(f"select distinct match_id from {self._full_name(table_name)}").match_id)
+
+    def write_table(self,
+                    table_name: str,
+                    dataframe: pd.DataFrame,
+                    if_exists: str = 'fail'):
+        from google.cloud import bigquery as bqc
+
+        write_disposition = {'fail': bqc.WriteDisposition.WRITE_EMPTY,
+                             'append': bqc.WriteDisposition.WRITE_APPEND,
+                             'replace': bqc.WriteDisposition.WRITE_TRUNCATE}[if_exists]
+        job_config = bqc.LoadJobConfig(source_format=bqc.SourceFormat.PARQUET,
+                                       write_disposition=write_disposition)
+        self.client.load_table_from_dataframe(dataframe,
+                                              self._full_name(table_name),
+                                              job_config=job_config).result()
+
+    def append(self,
+               table_name: str,
+               dataframe: pd.DataFrame):
+        self.write_table(table_name, dataframe, if_exists='append')
+
+    def delete_matches(self,
+                       table_name: str,
+                       match_ids):
+        query = f"""
+            delete from {self._full_name(table_name)}
+            where match_id in unnest(@match_ids)
+        """
+        from google.api_core.exceptions import NotFound
+
+        try:
+            self.query(query, [self._query_parameter('match_ids', list(match_ids))])
+        except NotFound:
+            # nothing to delete yet on the first load of a table. any other failure propagates, so a batch whose
+            # replaced or rolled back rows couldn't be deleted fails instead of leaving duplicates behind
+            print(f"{table_name} doesn't exist yet, nothing to delete")
+
+
+class ParquetStorage:
+    # local columnar copy of the same tables: <root_dir>/<table_name>/part-*.parquet, one part per write.
+    # reads are column projected and filtered by pyarrow, so scans don't parse the whole table
+    def __init__(self,
+                 root_dir: str = 'soccer_data'):
+        self.root_dir = root_dir
+
+    def __str__(self):
+        return f'parquet storage {self.root_dir}'
+
+    @property
+    def location(self) -> str:
+        return f'parquet://{os.path.abspath(self.root_dir)}'
+
+    def _table_dir(self,
+                   table_name: str) -> str:
+        return os.path.join(self.root_dir, _table_id(table_name))
+
+    def _part_paths(self,
+                    table_name: str) -> list:
+        return sorted(glob.glob(os.path.join(self._table_dir(table_name), '*.parquet')))
+
+    def read_table(self,
+                   table_name: str,
+                   columns: list = None,
+                   filters: list = None) -> pd.DataFrame:
+        import pyarrow.dataset as ds
+
+        paths = self._part_paths(table_name)
+        assert paths, f"Table {table_name} doesn't exist in {self.root_dir}"
+
+        expression = None
+        for group in _filter_groups(filters):
+            group_expression = None
+            for column, op, value in group:
+                assert op in FILTER_OPS, f"Filter operator must be one of {FILTER_OPS}"
+                field = ds.field(column)
+                condition = {'=': lambda: field == value,
+                             '!=': lambda: field != value,
+                             '<': lambda: field < value,
+                             '<=': lambda: field <= value,
+                             '>': lambda: field > value,
+                             '>=': lambda: field >= value,
+                             'in': lambda: field.isin(list(value)),
+                             'not in': lambda: ~field.isin(list(value))}[op]()
+                group_expression = condition if group_expression is None else group_expression & condition
+            expression = group_expression if expression is None else expression | group_expression
+
+        dataset = ds.dataset(paths, format='parquet')
+        return dataset.to_table(columns=columns, filter=expression).to_pandas()
+
+    def distinct_match_ids(self,
+                           table_name: str) -> set:
+        assert self._part_paths(table_name), f"Table {table_name} doesn't exist in {self.root_dir}"
+        return set(self.read_table(table_name, columns=['match_id']).match_id)
+
+    def write_table(self,
+                    table_name: str,
+                    dataframe: pd.DataFrame,
+                    if_exists: str = 'fail'):
+        assert if_exists in ['fail', 'append', 'replace'], "if_exists must be one of fail, append, replace"
+        existing = self._part_paths(table_name)
+
+        if existing and if_exists == 'fail':
+            raise ValueError(f"Table {table_name} already exists in {self.root_dir}")
+
+        table_dir = self._table_dir(table_name)
+        os.makedirs(table_dir, exist_ok=True)
+
+        # write to a temp file and rename so readers never see a partial part
+        path = os.path.join(table_dir, f'part-{uuid.uuid4().hex}.parquet')
+        dataframe.to_parquet(f'{path}.tmp', index=False)
+        os.replace(f'{path}.tmp', path)
+
+        if if_exists == 'replace':
+            for old_path in existing:
+                os.remove(old_path)
+
+    def append(self,
+               table_name: str,
+               dataframe: pd.DataFrame):
+        self.write_table(table_name, dataframe, if_exists='append')
+
+    def delete_matches(self,
+                       table_name: str,
+                       match_ids):
+        match_ids = set(match_ids)
+
+        for path in self._part_paths(table_name):
+            part = pd.read_parquet(path)
+            keep = ~part['match_id'].isin(match_ids)
+
+            if keep.all():
+                continue
+            if keep.any():
+                part[keep].to_parquet(f'{path}.tmp', index=False)
+                os.replace(f'{path}.tmp', path)
+            else:
+                os.remove(path)
+
+
+# copies tables between backends, e.g. BigQuery -> ParquetStorage to build features and train offline
+def mirror_tables(source,
+                  target,
+                  table_names: list = TABLE_NAMES,
+                  if_exists: str = 'replace'):
+    for table_name in table_names:
+        target.write_table(table_name, source.read_table(table_name), if_exists=if_exists)
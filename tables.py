@@ -0,0 +1,71 @@
+import os
+
+import pandas as pd
+
+from schema import compact
+
+
+FILE_FORMATS = {'.parquet': 'parquet', '.feather': 'feather', '.arrow': 'feather'}
+
+
+def _file_format(path: str) -> str:
+    extension = os.path.splitext(path)[1]
+    assert extension in FILE_FORMATS, f"Table files must end with one of {list(FILE_FORMATS)}"
+    return FILE_FORMATS[extension]
+
+
+def write_table(dataframe: pd.DataFrame,
+                path: str):
+    # Parquet (.parquet) or Feather / Arrow IPC (.feather, .arrow) with the compact columns of schema.py.
+    # Feather files are uncompressed so reads can memory map them
+    dataframe = compact(dataframe).reset_index(drop=True)
+
+    if _file_format(path) == 'parquet':
+        dataframe.to_parquet(f'{path}.tmp', index=False)
+    else:
+        dataframe.to_feather(f'{path}.tmp', compression='uncompressed')
+    os.replace(f'{path}.tmp', path)
+
+
+def read_table(path: str,
+               columns: list = None,
+               filters: list = None) -> pd.DataFrame:
+    # memory mapped, column projected read. filters follow storage.py (pyarrow's DNF), e.g. [('match_week', '<=', 30)]
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+
+    if _file_format(path) == 'parquet':
+        table = pq.read_table(path, columns=columns, filters=filters or None, memory_map=True)
+    else:
+        table = feather.read_table(path, columns=columns, memory_map=True)
+        if filters:
+            table = table.filter(pq.filters_to_expression(filters))
+
+    return table.to_pandas()
+
+
+def convert_csv(csv_path: str,
+                path: str = None) -> str:
+    # e.g. convert_csv('team_data.csv') -> team_data.parquet
+    path = path or os.path.splitext(csv_path)[0] + '.parquet'
+    write_table(pd.read_csv(csv_path, index_col=0 if _has_index_column(csv_path) else None), path)
+    return path
+
+
+def _has_index_column(csv_path: str) -> bool:
+    # the feature csvs are written with their index as an unnamed first column
+    with open(csv_path, 'r') as f:
+        return f.readline().startswith(',')
+
+
+def squads_to_table(squads: dict) -> pd.DataFrame:
+    # squads.pickle (team id -> squad dataframe) as one squad_data style table with contestantId
+    return pd.concat([squad.assign(contestantId=team_id) for team_id, squad in squads.items()], ignore_index=True)
+
+
+def read_squads(path: str) -> dict:
+    # the squads.pickle dict back from a squad table
+    squads = read_table(path)
+    squads['contestantId'] = squads['contestantId'].astype(str)
+    return {team_id: squad.drop(columns='contestantId').reset_index(drop=True)
+            for team_id, squad in squads.groupby('contestantId', sort=False, observed=True)}
@@ -0,0 +1,86 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# the repo's modules are flat at the root, the ordinal model's under models/lightgbm
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'models', 'lightgbm')]
+
+POSITIONS = ['Goalkeeper', 'Defender', 'Defender', 'Defender', 'Defender', 'Midfielder', 'Midfielder',
+             'Midfielder', 'Midfielder', 'Attacker', 'Attacker']
+
+
+def make_season(n_teams: int = 14,
+                squad_size: int = 16,
+                seed: int = 0,
+                start: str = '2024-08-17') -> dict:
+    # a double round robin in the shapes of the stored tables: calendar (MA1 matchInfo rows), team_data and
+    # player_data with 'YYYY-MM-DDZ' match dates, and a squads.pickle style dict of team id -> squad.
+    # one match of each week is played the day after the others, each team fields 11 starters and 3 subs of its
+    # squad, and one player per team is a guest missing from every squad
+    rng = np.random.default_rng(seed)
+    team_ids = [f'team{t:02d}' for t in range(n_teams)]
+    squads = {team_id: pd.DataFrame({'id': [f'{team_id}p{k:02d}' for k in range(squad_size)],
+                                     'matchName': [f'P. {team_id.title()}{k:02d}' for k in range(squad_size)],
+                                     'position': [(POSITIONS * 2)[k] for k in range(squad_size)]})
+              for team_id in team_ids}
+
+    # circle method, the second half mirrors the first with home and away swapped
+    rounds, order = [], list(range(n_teams))
+    for _ in range(n_teams - 1):
+        rounds.append([(order[i], order[n_teams - 1 - i]) for i in range(n_teams // 2)])
+        order = [order[0], order[-1]] + order[1:-1]
+    rounds += [[(away, home) for home, away in pairs] for pairs in rounds]
+
+    matches, team_rows, player_rows = [], [], []
+    for week, pairs in enumerate(rounds, start=1):
+        for k, (home, away) in enumerate(pairs):
+            day = pd.Timestamp(start) + pd.Timedelta(days=7 * (week - 1) + (k == 0))
+            match_id = f'm{week:02d}{k:02d}'
+            matches.append({'id': match_id, 'localDate': day.strftime('%Y-%m-%d'), 'week': week,
+                            'home_id': team_ids[home], 'away_id': team_ids[away],
+                            'lastUpdated': f'{day:%Y-%m-%d}T22:00:00Z'})
+
+            home_possession = float(np.round(rng.uniform(30, 70), 1))
+            for team, opponent, possession in [(home, away, home_possession), (away, home, 100 - home_possession)]:
+                team_id = team_ids[team]
+                team_rows.append({'match_id': match_id, 'match_date': f'{day:%Y-%m-%d}Z', 'team_id': team_id,
+                                  'opponent_id': team_ids[opponent], 'home': team == home,
+                                  'possessionPercentage': possession})
+
+                squad = squads[team_id]
+                picked = rng.choice(squad_size, 14, replace=False)
+                for slot, k in enumerate(picked):
+                    is_sub = slot >= 11
+                    player_rows.append({'match_id': match_id, 'match_date': f'{day:%Y-%m-%d}Z', 'team_id': team_id,
+                                        'playerId': squad.id[k], 'matchName': squad.matchName[k],
+                                        'position': 'Substitute' if is_sub else squad.position[k],
+                                        'isSub': is_sub,
+                                        'totalPass': float(rng.poisson(15 if is_sub else possession / 1.2)),
+                                        'minsPlayed': float(rng.integers(1, 30) if is_sub else rng.integers(60, 91))})
+
+                if week % 3 == team % 3:
+                    player_rows.append({'match_id': match_id, 'match_date': f'{day:%Y-%m-%d}Z', 'team_id': team_id,
+                                        'playerId': f'{team_id}guest', 'matchName': f'G. {team_id.title()}',
+                                        'position': 'Substitute', 'isSub': True,
+                                        'totalPass': float(rng.poisson(5)), 'minsPlayed': 10.0})
+
+    # row orders of the notebook's csv loads
+    team_data = pd.DataFrame(team_rows).sort_values(['match_date'], ascending=True).reset_index(drop=True)
+    player_data = pd.DataFrame(player_rows).sort_values(['match_date', 'match_id', 'team_id', 'playerId'],
+                                                        ascending=True).reset_index(drop=True)
+    return {'calendar': pd.DataFrame(matches), 'team_data': team_data, 'player_data': player_data, 'squads': squads}
+
+
+@pytest.fixture(scope='session')
+def season():
+    return make_season()
+
+
+@pytest.fixture(scope='session')
+def small_season():
+    # few enough matches for the per match pandas reference implementations
+    return make_season(n_teams=6, seed=1)
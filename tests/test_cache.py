@@ -0,0 +1,26 @@
+import os
+
+from cache import ResponseCache
+
+
+def _put(cache, k):
+    cache.put('matchstats', {'fx': f'match{k:04d}'}, {'payload': 'x' * 200}, immutable=True)
+
+
+def test_eviction_runs_down_to_low_water_mark(tmp_path):
+    cache = ResponseCache(str(tmp_path), max_bytes=20_000, evict_to=0.5)
+    scans = []
+    entry_paths = cache._entry_paths
+    cache._entry_paths = lambda: scans.append(1) or entry_paths()
+
+    for k in range(400):
+        _put(cache, k)
+        assert cache._total_bytes <= cache.max_bytes
+
+    assert cache._total_bytes == sum(os.path.getsize(path) for path in entry_paths())
+    entry_size = cache._total_bytes / len(list(entry_paths()))
+    # one scan for the initial size, then one per half cache of writes instead of one per write past capacity
+    assert len(scans) <= 1 + 400 * entry_size / (0.5 * cache.max_bytes) + 1
+    # least recently used entries went first
+    assert cache.get('matchstats', {'fx': 'match0399'}) is not None
+    assert cache.get('matchstats', {'fx': 'match0000'}) is None
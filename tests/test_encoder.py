@@ -0,0 +1,34 @@
+import numpy as np
+
+from encoder import OrdinalLabelEncoder
+
+
+def test_unmerged_classes_round_trip():
+    y = np.array([0, 3, 1, 3, 5, 1, 1])
+    encoder = OrdinalLabelEncoder().fit(y)
+    classes = encoder.transform(y)
+    assert np.array_equal(classes, [0, 2, 1, 2, 3, 1, 1])
+    decoded = encoder.inverse_transform(classes)
+    assert decoded.dtype == y.dtype
+    assert np.array_equal(decoded, y)
+
+
+def test_merged_classes_decode_to_most_frequent_value():
+    # 7 and 9 are rare and merge into the class of 6, which keeps its most frequent value 6 as the label
+    y = np.array([0] * 5 + [1] * 5 + [6] * 3 + [7] + [9])
+    encoder = OrdinalLabelEncoder(min_count=3).fit(y)
+    assert encoder.n_classes == 3
+    assert np.array_equal(encoder.lower_, [0, 1, 6]) and np.array_equal(encoder.upper_, [0, 1, 9])
+    assert np.allclose(encoder.values_, [0, 1, (3 * 6 + 7 + 9) / 5])
+
+    decoded = encoder.inverse_transform([0, 1, 2])
+    assert decoded.dtype == y.dtype
+    assert np.array_equal(decoded, [0, 1, 6])
+    assert np.allclose(encoder.expected_value(np.eye(3)), encoder.values_)
+
+
+def test_float_labels_stay_float():
+    y = np.array([0.0, 0.5, 0.5, 2.0])
+    encoder = OrdinalLabelEncoder().fit(y)
+    assert np.array_equal(encoder.inverse_transform(encoder.transform(y)), y)
+    assert encoder.inverse_transform([0]).dtype == float
@@ -0,0 +1,79 @@
+import itertools
+import uuid
+
+import pandas as pd
+import pytest
+
+import storage
+from feature_store import FeatureStore
+from features import FeatureEngine
+
+
+@pytest.fixture
+def engine(season):
+    return FeatureEngine(season['team_data'], season['player_data'], season['squads'])
+
+
+@pytest.fixture(params=['new_part_last', 'new_part_first'])
+def part_order(request, monkeypatch):
+    # parts are read in file name order, part-<uuid4 hex>.parquet. the names are made increasing or decreasing
+    # so both orders of the incremental part and the initial one are read
+    counter = itertools.count() if request.param == 'new_part_last' else itertools.count(2 ** 64, -1)
+    monkeypatch.setattr(storage.uuid, 'uuid4', lambda: uuid.UUID(int=next(counter)))
+    return request.param
+
+
+def test_parts_with_different_category_counts_read_as_one_version(tmp_path, season, engine, part_order):
+    # the first write has more than 127 matches / players, the second fewer, so their categoricals used to be
+    # written with int16 and int8 dictionary indices that one dataset can't read together
+    calendar = season['calendar']
+    last_week = calendar.week.max()
+    store = FeatureStore(str(tmp_path))
+
+    store.update('v1', engine, calendar[calendar.week < last_week])
+    store.update('v1', engine, calendar)
+
+    assert store.materialized_match_ids('v1') == set(calendar.id)
+    features = store.read('v1')
+    assert features.shape[0] == season['player_data'].shape[0]
+    assert isinstance(features.player_id.dtype, pd.CategoricalDtype)
+
+
+def test_incremental_update_matches_one_build(tmp_path, season, engine):
+    # weeks 1..N, then week N + 1 only computes its own matches, and the version reads back like one build
+    calendar = season['calendar']
+    first_weeks = calendar[calendar.week <= 10]
+    next_week = calendar[calendar.week <= 11]
+    store = FeatureStore(str(tmp_path))
+
+    first = store.update('v1', engine, first_weeks)
+    assert set(first.match_id) == set(first_weeks.id)
+    added = store.update('v1', engine, next_week)
+    assert set(added.match_id) == set(calendar.id[calendar.week == 11])
+    assert store.update('v1', engine, next_week).shape[0] == 0
+    assert store.materialized_match_ids('v1') == set(next_week.id)
+
+    columns = ['player_id', 'match_id', 'match_date', 'match_week', 'is_home', 'p_avg_passes', 't_posw_possession',
+               'target']
+    features = store.read('v1', columns=columns, filters=[('match_week', '>=', 10)])
+    expected = engine.build(next_week[next_week.week >= 10])
+
+    assert list(features.columns) == columns
+    assert features.shape[0] == expected.shape[0]
+    assert set(features.match_id) == set(next_week.id[next_week.week >= 10])
+    assert isinstance(features.player_id.dtype, pd.CategoricalDtype)
+    assert isinstance(features.match_id.dtype, pd.CategoricalDtype)
+    assert pd.api.types.is_datetime64_any_dtype(features.match_date)
+    assert features.p_avg_passes.dtype == 'float32'
+    assert features.is_home.dtype == bool
+
+    features = features.astype({'player_id': str, 'match_id': str}).sort_values(['match_id', 'player_id'])
+    expected = expected.sort_values(['match_id', 'player_id'])
+    for column in ['p_avg_passes', 't_posw_possession', 'target']:
+        pd.testing.assert_series_equal(features[column].reset_index(drop=True),
+                                       expected[column].astype('float32').reset_index(drop=True))
+
+    # match dates filter on timestamps
+    week_11 = store.read('v1', columns=['match_id'],
+                         filters=[('match_date', '>=', pd.Timestamp(next_week.localDate[next_week.week == 11].min()))])
+    assert set(week_11.match_id) == set(calendar.id[calendar.week == 11])
@@ -0,0 +1,144 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import features
+from features import FeatureEngine, build_features, gaussian_weight
+
+
+# get_match_vectors and its helpers as implemented in data_testing.ipynb, the reference FeatureEngine has to
+# reproduce. only the notebook's team_mappings lookup of opponent names is left out, it doesn't reach the output
+def _get_team_stats_vector(team_data):
+    if team_data.shape[0] == 0:
+        avg_possession = np.nan
+        weighted_possession = np.nan
+    else:
+        avg_possession = team_data.possessionPercentage.mean()
+        weighted_possession = (team_data.possessionPercentage * team_data.poss_weight).sum() \
+            / team_data.poss_weight.sum()
+
+    return {
+        't_avg_possession': avg_possession,
+        't_posw_possession': weighted_possession
+    }
+
+
+def _get_player_stats(player_performances,
+                      team_performances):
+    team_performances = team_performances.sort_values('match_date', ascending=True)
+    last_5_team_perf = team_performances.iloc[-5:].match_id
+
+    player_last_5_perf = player_performances[player_performances['match_id'].isin(last_5_team_perf)]
+
+    if player_performances.shape[0] == 0:
+        avg_passAtt = np.nan
+        std_passAtt = np.nan
+        avg_minsPlayed = np.nan
+        weighted_passAtt = np.nan
+    else:
+        avg_passAtt = player_performances.totalPass.mean()
+        std_passAtt = player_performances.totalPass.std()
+        avg_minsPlayed = player_performances.minsPlayed.mean()
+        weighted_passAtt = (player_performances['totalPass'] * player_performances['poss_weight'].astype(float)).sum() \
+            / player_performances['poss_weight'].astype(float).sum()
+
+    return {
+        'p_avg_passes': avg_passAtt,
+        'p_std_passes': std_passAtt,
+        'p_avg_minsPlayed': avg_minsPlayed,
+        'p_weighted_passes': weighted_passAtt,
+        'p_last5_minsPlayed': player_last_5_perf.minsPlayed.mean() if not player_last_5_perf.empty else 0
+    }
+
+
+def get_match_vectors(match,
+                      all_performances,
+                      all_squads,
+                      all_player_data,
+                      training=True):
+    final_feat_list = []
+
+    team_ids = {'home': match.home_id,
+                'away': match.away_id}
+
+    team_data = {
+        team: all_performances[(all_performances['team_id'] == team_ids[team]) &
+                               (all_performances['match_date'].apply(lambda x: x.replace('Z', '')) < match.localDate)]
+        for team in ['home', 'away']
+    }
+    squad_data = {team: all_squads[team_ids[team]] for team in ['home', 'away']}
+
+    for team in ['home', 'away']:
+        mask2 = (all_performances['match_id'] == match.id) & (all_performances['team_id'] == team_ids[team])
+        cheat_possession = all_performances[mask2].iloc[0].possessionPercentage
+
+        team_data[team]['poss_weight'] = gaussian_weight(team_data[team].possessionPercentage,
+                                                         cheat_possession,
+                                                         team_data[team].possessionPercentage.std())
+        team_data[team]['poss_weight'] = team_data[team]['poss_weight'].astype(float) ** 2
+
+        team_stats_vector = _get_team_stats_vector(team_data[team])
+
+        historical_player_data = all_player_data[
+            (all_player_data['playerId'].isin(squad_data[team].id.unique())) &
+            (all_player_data['match_date'].apply(lambda x: x.replace('Z', '')) < match.localDate)]
+        historical_player_data = historical_player_data.merge(team_data[team][['match_id', 'team_id', 'poss_weight']],
+                                                              how='left',
+                                                              on=['match_id', 'team_id'])
+
+        team_squad = all_player_data[(all_player_data['team_id'] == team_ids[team]) &
+                                     (all_player_data['match_id'] == match.id)]
+
+        for i, player in team_squad.iterrows():
+            final_dict = {
+                'player_id': player.playerId,
+                'player_name': player.matchName,
+                'player_position': player.position,
+                'team_id': team_ids[team],
+                'match_id': match.id,
+                'match_date': match.localDate,
+                'match_week': match.week,
+                'is_home': True if team == 'home' else False
+            }
+
+            player_performances = historical_player_data[historical_player_data['playerId'] == player.playerId]
+            final_dict.update(_get_player_stats(player_performances, team_data[team]))
+            final_dict.update(team_stats_vector)
+
+            if training == True:
+                mask = (all_player_data['match_id'] == match.id) & (all_player_data['playerId'] == player.playerId)
+                performance = all_player_data[mask].iloc[0]
+                final_dict['is_sub'] = performance.isSub
+                final_dict['target'] = performance.totalPass
+
+            final_feat_list.append(final_dict)
+
+    return final_feat_list
+
+
+@pytest.fixture(scope='module')
+def legacy_features(small_season):
+    rows = []
+    # teams / players with fewer than two earlier matches divide 0 by 0 into NaN
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for match in small_season['calendar'].itertuples(index=False):
+            rows.extend(get_match_vectors(match, small_season['team_data'], small_season['squads'],
+                                          small_season['player_data']))
+    return pd.DataFrame(rows)
+
+
+def test_engine_matches_get_match_vectors(small_season, legacy_features):
+    engine = FeatureEngine(small_season['team_data'], small_season['player_data'], small_season['squads'])
+    built = engine.build(small_season['calendar'])
+
+    # same rows, columns and order; values up to the rounding of running sums against pandas reductions
+    pd.testing.assert_frame_equal(built, legacy_features, check_exact=False, rtol=1e-9, atol=1e-12)
+
+
+def test_build_features_on_workers_matches_get_match_vectors(small_season, legacy_features, monkeypatch):
+    # small enough a calendar to be built in process otherwise
+    monkeypatch.setattr(features, 'MIN_MATCHES_PER_WORKER', 5)
+    built = build_features(small_season['team_data'], small_season['player_data'], small_season['squads'],
+                           small_season['calendar'], max_workers=2)
+
+    pd.testing.assert_frame_equal(built, legacy_features, check_exact=False, rtol=1e-9, atol=1e-12)
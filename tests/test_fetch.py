@@ -0,0 +1,146 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from data import DataLoader
+from storage import ParquetStorage
+
+
+N_MATCHES = 24
+# matches whose first two MA2 requests fail with a 503, and one that never comes back
+FLAKY_IDS = {'match03', 'match10', 'match17'}
+BROKEN_ID = 'match20'
+
+
+def _ma1_fixture():
+    return {'match': [{'matchInfo': {
+        'id': f'match{k:02d}',
+        'date': f'2024-08-{10 + k // 4:02d}Z',
+        'localDate': f'2024-08-{10 + k // 4:02d}',
+        'week': str(1 + k // 4),
+        'lastUpdated': '2024-09-01T10:00:00Z',
+        'description': f'Home {k} vs Away {k}',
+        'contestant': [{'id': f'home{k}', 'position': 'home'}, {'id': f'away{k}', 'position': 'away'}],
+        'tournamentCalendar': {'id': 'tmcl', 'name': '2024/2025'},
+        'competition': {'name': 'Premier League'},
+        'venue': {}, 'sport': {}, 'ruleset': {}, 'stage': {},
+    }} for k in range(N_MATCHES)]}
+
+
+def _ma2_fixture(match_id):
+    return {'matchInfo': {'id': match_id}, 'liveData': {'matchDetails': {'matchStatus': 'Played'}}}
+
+
+class StandIn:
+    # canned StatsPerform feeds, recording when each MA2 request arrived and how many were served at once
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.requests = []
+
+    def handler(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body=None):
+                payload = json.dumps(body if body is not None else {'error': status}).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                feed = url.path.strip('/').split('/')[0]
+                if feed == 'match':
+                    return self._send(200, _ma1_fixture())
+
+                match_id = parse_qs(url.query)['fx'][0]
+                with stand_in.lock:
+                    attempt = sum(1 for _, requested in stand_in.requests if requested == match_id)
+                    stand_in.requests.append((time.monotonic(), match_id))
+                    stand_in.in_flight += 1
+                    stand_in.max_in_flight = max(stand_in.max_in_flight, stand_in.in_flight)
+                try:
+                    # later matches answer faster, so downloads finish out of calendar order
+                    time.sleep(0.01 + 0.004 * (N_MATCHES - int(match_id[-2:])))
+                    if match_id == BROKEN_ID or (match_id in FLAKY_IDS and attempt < 2):
+                        return self._send(503)
+                    return self._send(200, _ma2_fixture(match_id))
+                finally:
+                    with stand_in.lock:
+                        stand_in.in_flight -= 1
+
+        return Handler
+
+
+@pytest.fixture
+def stand_in(monkeypatch):
+    monkeypatch.setenv('STATSPERFORM_API_KEY', 'test-key')
+    monkeypatch.setenv('NO_PROXY', '127.0.0.1,localhost')
+    monkeypatch.setenv('no_proxy', '127.0.0.1,localhost')
+
+    stand_in = StandIn()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), stand_in.handler())
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    stand_in.base_url = f'http://127.0.0.1:{server.server_address[1]}'
+    yield stand_in
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def loader(stand_in, tmp_path):
+    loader = DataLoader('tmcl',
+                        statsperform_base_url=stand_in.base_url,
+                        proxy_url=None,
+                        max_retries=2,
+                        cache_dir=None,
+                        storage=ParquetStorage(str(tmp_path)),
+                        lazy=True)
+    yield loader
+    loader.close_http_session()
+
+
+def test_fetch_game_stats_against_stand_in(stand_in, loader):
+    match_ids = list(loader.matches.id)
+    assert match_ids == [f'match{k:02d}' for k in range(N_MATCHES)]
+
+    max_workers, max_requests_per_second = 4, 40
+    results = list(loader.fetch_game_stats(match_ids,
+                                           max_workers=max_workers,
+                                           max_requests_per_second=max_requests_per_second))
+
+    # calendar order, whatever order the downloads finished in
+    assert [match_id for match_id, _ in results] == match_ids
+    for match_id, payload in results:
+        if match_id == BROKEN_ID:
+            assert payload is None
+        else:
+            assert payload['matchInfo']['id'] == match_id
+
+    # never more requests in flight than workers, but more than one at a time
+    assert 1 < stand_in.max_in_flight <= max_workers
+
+    # retries of 5xx responses: flaky matches took three requests, the broken one every retry
+    attempts = {match_id: sum(1 for _, requested in stand_in.requests if requested == match_id)
+                for match_id in match_ids}
+    assert all(attempts[match_id] == 3 for match_id in FLAKY_IDS)
+    assert attempts[BROKEN_ID] == 3
+    assert all(count == 1 for match_id, count in attempts.items() if match_id not in FLAKY_IDS | {BROKEN_ID})
+
+    # the rate limit spaces out the first request of every match, retries are paced by the backoff instead
+    first_requests = sorted(min(at for at, requested in stand_in.requests if requested == match_id)
+                            for match_id in match_ids)
+    gaps = [later - earlier for earlier, later in zip(first_requests, first_requests[1:])]
+    assert min(gaps) >= 0.8 / max_requests_per_second
@@ -0,0 +1,195 @@
+import numpy as np
+import pytest
+from scipy.special import expit, logsumexp
+
+from loss import (
+    FusedOrdinalLoss,
+    alpha2theta,
+    alpha_gradient,
+    gradient_ordinal_logistic_nll,
+    hessian_ordinal_logistic_nll,
+    lgb_ordinal_loss,
+    log1mexp,
+    log_probas_from_y_pred,
+    ordinal_logistic_nll,
+    ordinal_logistic_nll_theta_gradient,
+    probas_from_y_pred,
+    theta2alpha,
+)
+
+
+THETA = np.array([-2.0, -0.5, 0.3, 1.0, 2.5])
+# adjacent thresholds 0.01 apart, where the difference of sigmoids lost most of its digits
+CLOSE_THETA = np.linspace(0, 0.6, 60)
+STEP = 1e-5
+
+# property checks run for every (number of classes, threshold spacing, seed)
+CASES = [(n_classes, spacing, seed)
+         for n_classes in [2, 3, 10, 40] for spacing in ['spread', 'close'] for seed in range(3)]
+
+
+def _thresholds(n_classes, spacing, rng):
+    # 'spread': gaps of 0.2 to 2, 'close': gaps of 0.001 to 0.01 where log1mexp of the gap does the work
+    low, high = (0.2, 2.0) if spacing == 'spread' else (1e-3, 1e-2)
+    return rng.normal(0, 2) + np.cumsum(np.r_[0, rng.uniform(low, high, n_classes - 2)])
+
+
+def _rows(theta, n_rows=200, spread=3.0, seed=0, extreme=0.0):
+    # labels and predictions around the thresholds, a share `extreme` of the predictions 30 to 800 past them
+    rng = np.random.default_rng(seed)
+    y_true = rng.integers(0, len(theta) + 1, n_rows).astype(float)
+    y_preds = rng.uniform(theta[0] - spread, theta[-1] + spread, n_rows)
+    far = rng.random(n_rows) < extreme
+    y_preds[far] = np.where(rng.random(far.sum()) < 0.5, theta[0], theta[-1]) \
+        + rng.choice([-1, 1], far.sum()) * rng.uniform(30, 800, far.sum())
+    return y_true, y_preds
+
+
+@pytest.fixture(params=CASES, ids=lambda case: '{}-classes-{}-seed{}'.format(*case))
+def case(request):
+    n_classes, spacing, seed = request.param
+    rng = np.random.default_rng(seed)
+    theta = _thresholds(n_classes, spacing, rng)
+    y_true, y_preds = _rows(theta, seed=seed + 100, extreme=0.2)
+    return theta, y_true, y_preds
+
+
+def _row_nll(y_true, y_preds, theta):
+    return np.array([ordinal_logistic_nll(y_true[i:i + 1], y_preds[i:i + 1], theta) for i in range(len(y_true))])
+
+
+def test_log1mexp():
+    d = np.array([1e-300, 1e-10, 0.5, np.log(2), 1.0, 40.0, 800.0])
+    expected = np.log(-np.expm1(-d))
+    assert np.allclose(log1mexp(d), expected, rtol=1e-14)
+    assert log1mexp(np.inf) == 0.0
+
+
+def test_alpha_theta_round_trip(case):
+    theta, _, _ = case
+    assert np.allclose(alpha2theta(theta2alpha(theta)), theta, rtol=1e-12, atol=1e-14)
+
+
+def test_probas_sum_to_one(case):
+    theta, _, y_preds = case
+    with np.errstate(all='raise'):
+        log_probas = log_probas_from_y_pred(y_preds, theta)
+    assert log_probas.shape == (len(y_preds), len(theta) + 1)
+    # finite even for classes 0.001 wide hundreds of units from the prediction
+    assert np.all(np.isfinite(log_probas)) and np.all(log_probas <= 0)
+    assert np.allclose(logsumexp(log_probas, axis=1), 0.0, atol=1e-12)
+    assert np.allclose(probas_from_y_pred(y_preds, theta).sum(axis=1), 1.0, rtol=1e-12)
+
+
+def test_log_probas_match_difference_of_sigmoids(case):
+    # where the plain cdf differences keep their digits they agree with the log space probabilities
+    theta, _, y_preds = case
+    cdf = np.hstack([np.zeros((len(y_preds), 1)), expit(theta - y_preds[:, np.newaxis]), np.ones((len(y_preds), 1))])
+    probas = np.diff(cdf, axis=1)
+    accurate = probas > 1e-6
+    assert np.allclose(np.exp(log_probas_from_y_pred(y_preds, theta))[accurate], probas[accurate], rtol=1e-8)
+
+
+def test_nll_is_sum_of_label_log_probas(case):
+    theta, y_true, y_preds = case
+    log_probas = log_probas_from_y_pred(y_preds, theta)
+    expected = -log_probas[np.arange(len(y_true)), y_true.astype(int)].sum()
+    assert np.isclose(ordinal_logistic_nll(y_true, y_preds, theta), expected, rtol=1e-12)
+
+
+def test_gradient_matches_finite_differences(case):
+    theta, y_true, y_preds = case
+    numeric = (_row_nll(y_true, y_preds + STEP, theta) - _row_nll(y_true, y_preds - STEP, theta)) / (2 * STEP)
+    assert np.allclose(gradient_ordinal_logistic_nll(y_true, y_preds, theta), numeric, rtol=1e-6, atol=1e-6)
+
+
+def test_hessian_matches_finite_differences(case):
+    theta, y_true, y_preds = case
+    numeric = (gradient_ordinal_logistic_nll(y_true, y_preds + STEP, theta)
+               - gradient_ordinal_logistic_nll(y_true, y_preds - STEP, theta)) / (2 * STEP)
+    hessian = hessian_ordinal_logistic_nll(y_true, y_preds, theta)
+    assert np.all(hessian >= 0)
+    assert np.allclose(hessian, numeric, rtol=1e-6, atol=1e-8)
+
+
+def test_theta_gradient_matches_finite_differences(case):
+    theta, y_true, y_preds = case
+    nll, gradient = ordinal_logistic_nll_theta_gradient(y_true, y_preds, theta)
+    assert np.isclose(nll, ordinal_logistic_nll(y_true, y_preds, theta), rtol=1e-12)
+
+    # steps well within the smallest gap, so no threshold crosses its neighbour
+    step = min(STEP, 1e-4 * np.min(np.diff(theta), initial=1.0))
+    numeric = np.empty(len(theta))
+    for t in range(len(theta)):
+        shift = np.zeros(len(theta))
+        shift[t] = step
+        numeric[t] = (ordinal_logistic_nll(y_true, y_preds, theta + shift)
+                      - ordinal_logistic_nll(y_true, y_preds, theta - shift)) / (2 * step)
+    assert np.allclose(gradient, numeric, rtol=1e-5, atol=1e-4)
+
+
+def test_alpha_gradient_matches_finite_differences(case):
+    theta, y_true, y_preds = case
+    alpha = theta2alpha(theta)
+    _, theta_gradient = ordinal_logistic_nll_theta_gradient(y_true, y_preds, theta)
+
+    numeric = np.empty(len(alpha))
+    for j in range(len(alpha)):
+        shift = np.zeros(len(alpha))
+        shift[j] = STEP
+        numeric[j] = (ordinal_logistic_nll(y_true, y_preds, alpha2theta(alpha + shift))
+                      - ordinal_logistic_nll(y_true, y_preds, alpha2theta(alpha - shift))) / (2 * STEP)
+    assert np.allclose(alpha_gradient(alpha, theta_gradient), numeric, rtol=1e-5, atol=1e-4)
+
+
+def test_extreme_margins():
+    # predictions hundreds of units past the thresholds, where the sigmoid matrices of the first implementation
+    # overflowed in exp and the cdf differences rounded to 0 (log -inf) or 1 - 1 (0 / 0 gradients)
+    y_preds = np.array([-800.0, -800.0, 800.0, 800.0])
+    y_true = np.array([0, 5, 0, 5], dtype=float)
+
+    with np.errstate(all='raise'):
+        log_probas = log_probas_from_y_pred(y_preds, THETA)
+        gradient = gradient_ordinal_logistic_nll(y_true, y_preds, THETA)
+        hessian = hessian_ordinal_logistic_nll(y_true, y_preds, THETA)
+
+    label_log_probas = log_probas[np.arange(4), y_true.astype(int)]
+    # log P(y = 0 | f = 800) = log sigmoid(theta[0] - 800) ~ theta[0] - 800, log P(y = 5 | f = -800) likewise
+    assert np.allclose(label_log_probas, [0.0, -800.0 - THETA[-1], THETA[0] - 800.0, 0.0], atol=1e-12)
+    assert np.allclose(ordinal_logistic_nll(y_true, y_preds, THETA), -label_log_probas.sum())
+    # the label far above the prediction pulls it up with unit gradient, far below pushes it down
+    assert np.allclose(gradient, [0.0, -1.0, 1.0, 0.0], atol=1e-12)
+    assert np.all(np.isfinite(hessian)) and np.all(hessian >= 0)
+
+
+def test_close_thresholds_far_from_prediction():
+    # a middle class 0.01 wide, 40 units away: P ~ 1e-20, which the difference of two sigmoids near 1 loses entirely
+    y_preds = np.array([-40.0, 40.0])
+    log_probas = log_probas_from_y_pred(y_preds, CLOSE_THETA)
+    assert np.all(np.isfinite(log_probas))
+
+    # P = sigmoid(u) - sigmoid(l) ~ exp(-l) - exp(-u) below the thresholds and exp(u) - exp(l) above them
+    gap = CLOSE_THETA[31] - CLOSE_THETA[30]
+    expected = [-(CLOSE_THETA[30] + 40.0) + np.log(-np.expm1(-gap)), CLOSE_THETA[31] - 40.0 + np.log(-np.expm1(-gap))]
+    assert np.allclose(log_probas[:, 31], expected, rtol=1e-10)
+
+
+def test_fused_loss_matches_reference(case):
+    theta, y_true, y_preds = case
+    fused = FusedOrdinalLoss()
+    for _ in range(2):
+        grad, hess = fused(y_true, y_preds, theta)
+        assert np.allclose(grad, gradient_ordinal_logistic_nll(y_true, y_preds, theta), rtol=1e-12, atol=1e-15)
+        assert np.allclose(hess, hessian_ordinal_logistic_nll(y_true, y_preds, theta), rtol=1e-12, atol=1e-15)
+        y_preds = y_preds[::-1].copy()
+
+
+def test_lgb_ordinal_loss_reuses_buffers():
+    y_true, y_preds = _rows(THETA, n_rows=500)
+    grad, hess = lgb_ordinal_loss(y_true, y_preds, THETA)
+    assert np.allclose(grad, gradient_ordinal_logistic_nll(y_true, y_preds, THETA), rtol=1e-12, atol=1e-15)
+    assert np.allclose(hess, hessian_ordinal_logistic_nll(y_true, y_preds, THETA), rtol=1e-12, atol=1e-15)
+
+    next_grad, next_hess = lgb_ordinal_loss(y_true, y_preds + 1.0, THETA)
+    assert next_grad is grad and next_hess is hess
+    assert np.allclose(next_grad, gradient_ordinal_logistic_nll(y_true, y_preds + 1.0, THETA), rtol=1e-12, atol=1e-15)
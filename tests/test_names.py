@@ -0,0 +1,47 @@
+import os
+import pickle
+
+import pytest
+
+from names import NameResolver, normalize_name
+from rosters import RosterIndex
+
+
+ARSENAL = '4dsgumo7d4zupm2ugsvm4zm4d'
+
+
+@pytest.fixture(scope='module')
+def resolver():
+    with open(os.path.join(os.path.dirname(__file__), '..', 'squads.pickle'), 'rb') as f:
+        return NameResolver.from_roster(RosterIndex(pickle.load(f)))
+
+
+def test_normalize_name():
+    assert normalize_name('M. Ødegaard') == 'm odegaard'
+    assert normalize_name("S. Oulad M'Hand") == 's oulad m hand'
+
+
+@pytest.mark.parametrize('raw_name, expected', [
+    ('B. Saka', 'B. Saka'),
+    ('Saka', 'B. Saka'),
+    ('Bukayo Saka', 'B. Saka'),
+    ('Odegaard', 'M. Ødegaard'),
+    ('K Tierny', 'K. Tierney'),
+    ('Kai Havertz', 'K. Havertz'),
+])
+def test_resolves_squad_players(resolver, raw_name, expected):
+    player_id, player_name, score = resolver.resolve(ARSENAL, raw_name)
+    assert player_name == expected
+    assert score >= resolver.min_score
+
+
+@pytest.mark.parametrize('raw_name', ['Kepa', 'Silva', 'K'])
+def test_initial_only_matches_are_unresolved(resolver, raw_name):
+    # a full name matching nothing but a squad player's initial (K. Tierney, S. Oulad M'Hand) isn't a match
+    assert resolver.resolve(ARSENAL, raw_name)[:2] == (None, None)
+
+
+def test_resolve_many_aligns_rows(resolver):
+    resolved = resolver.resolve_many([ARSENAL, ARSENAL, 'unknown team', ARSENAL], ['Saka', 'Kepa', 'Saka', 'Saka'])
+    assert resolved.player_name.tolist()[::3] == ['B. Saka', 'B. Saka']
+    assert resolved.player_id.iloc[1:3].isna().all()
@@ -0,0 +1,79 @@
+import pandas as pd
+
+from schema import storable
+
+
+class BatchWriter:
+    # buffers per-match frames and flushes them to a storage backend (storage.py) every `max_matches` matches
+    # or `max_rows` rows, so memory stays bounded by one batch and every flushed batch survives a later failure.
+    # `on_flush` is called with the flushed matches' ledger rows once all their tables are written
+    def __init__(self,
+                 sink,
+                 max_matches: int = 20,
+                 max_rows: int = None,
+                 on_flush=None):
+        self.sink = sink
+        self.max_matches = max_matches
+        self.max_rows = max_rows
+        self.on_flush = on_flush
+
+        self.flushed_match_ids = []
+        self._reset()
+
+    def _reset(self):
+        self._frames = {}
+        self._match_ids = []
+        self._replaced_match_ids = []
+        self._ledger_rows = []
+        self._n_rows = 0
+
+    def add(self,
+            match_id: str,
+            frames: dict,
+            ledger_row=None,
+            replace: bool = False):
+        # frames: table name -> rows of this match for that table
+        for table_name, frame in frames.items():
+            self._frames.setdefault(table_name, []).append(frame)
+            self._n_rows += frame.shape[0]
+
+        self._match_ids.append(match_id)
+        if replace:
+            self._replaced_match_ids.append(match_id)
+        if ledger_row is not None:
+            self._ledger_rows.append(ledger_row)
+
+        if len(self._match_ids) >= self.max_matches or (self.max_rows and self._n_rows >= self.max_rows):
+            self.flush()
+
+    def record(self,
+               ledger_row):
+        # matches with nothing to write still get recorded with the next flush
+        self._ledger_rows.append(ledger_row)
+
+    def flush(self):
+        if not self._frames and not self._ledger_rows:
+            return
+
+        written_tables = []
+        try:
+            for table_name, frames in self._frames.items():
+                # corrected matches replace the rows loaded from their previous payload
+                if self._replaced_match_ids:
+                    self.sink.delete_matches(table_name, self._replaced_match_ids)
+
+                # compact in memory frames (schema.py) go back to the stored column types
+                self.sink.append(table_name, storable(pd.concat(frames, axis=0, ignore_index=True)))
+                written_tables.append(table_name)
+        except Exception:
+            # don't leave a batch half written across tables, the matches get retried on the next run
+            for table_name in written_tables:
+                self.sink.delete_matches(table_name, self._match_ids)
+            raise
+
+        if self.on_flush is not None and self._ledger_rows:
+            self.on_flush(self._ledger_rows)
+
+        print(f"Flushed {len(self._match_ids)} matches ({self._n_rows} rows)")
+        self.flushed_match_ids.extend(self._match_ids)
+        self._reset()